@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import numpy as np
+
+# the tracks are compared as mono PCM at this rate, enough for speech
+ALIGN_SAMPLE_RATE = 8000
+# seconds of the audio track that are compared, starting at ALIGN_START
+ALIGN_START = 60
+ALIGN_WINDOW = 60
+# the largest offset searched in either direction, in seconds
+MAX_ALIGN_OFFSET = 30
+# below this normalized correlation the offset is not trusted
+MIN_ALIGN_SCORE = 0.2
+# the references of the most recently muxed videos a process keeps decoded
+MAX_CACHED_REFERENCES = 4
+
+# (video file, mtime) -> VideoReference, the least recently used first
+_references = OrderedDict()
+_references_lock = threading.Lock()
+
+
+def read_pcm(file_path, start, duration, sample_rate=ALIGN_SAMPLE_RATE):
+    """ Decode a window of a file's audio to mono float PCM, only that window is read into memory
+    :param start: the start of the window in seconds
+    :param duration: the length of the window in seconds
+    :return: a float32 numpy array
+    """
+    out, _ = (
+        ffmpeg
+        .input(file_path, ss=start, t=duration)
+        .output("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate)
+        .run(capture_stdout=True, quiet=True)
+    )
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32)
+
+
+def cross_correlate(reference, signal):
+    """ Find where a signal fits best inside a longer reference with an FFT cross-correlation
+    Only lags where the signal lies fully inside the reference are considered.
+    :return: a tuple (lag in samples, normalized correlation score between -1 and 1)
+    """
+    reference = reference - reference.mean()
+    signal = signal - signal.mean()
+    size = 1 << int(len(reference) + len(signal) - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(reference, size) * np.conj(np.fft.rfft(signal, size)), size)
+    valid = correlation[:len(reference) - len(signal) + 1]
+    # energy of every reference window the signal is compared against
+    energy = np.concatenate(([0.0], np.cumsum(reference.astype(np.float64) ** 2)))
+    window_energy = energy[len(signal):] - energy[:-len(signal)]
+    norm = np.sqrt(np.maximum(window_energy, 1e-9)) * max(np.linalg.norm(signal), 1e-9)
+    scores = valid / norm
+    lag = int(np.argmax(scores))
+    return lag, float(scores[lag])
+
+
+def align_track(reference, reference_start, audio_file, sample_rate=ALIGN_SAMPLE_RATE):
+    """ Find the offset of an audio track against the video's own audio
+    :param reference: the video's PCM from reference_start on
+    :param reference_start: where the reference starts in the video, in seconds
+    :return: a tuple (offset in seconds the audio starts after the video, match score)
+    """
+    signal = read_pcm(audio_file, ALIGN_START, ALIGN_WINDOW, sample_rate)
+    if len(signal) == 0 or len(signal) > len(reference):
+        return 0.0, 0.0
+    lag, score = cross_correlate(reference, signal)
+    # audio time ALIGN_START plays at video time reference_start + lag
+    return reference_start + lag / sample_rate - ALIGN_START, score
+
+
+def video_reference(video_file):
+    """ Decode the part of the video's own audio the tracks are searched in
+    :return: a tuple (reference PCM, start of the reference in the video in seconds)
+    """
+    reference_start = max(0, ALIGN_START - MAX_ALIGN_OFFSET)
+    return read_pcm(video_file, reference_start, ALIGN_WINDOW + 2 * MAX_ALIGN_OFFSET), reference_start
+
+
+class VideoReference:
+    """ The video's own audio, decoded on first use and shared by the alignment of every language track """
+
+    def __init__(self, video_file):
+        self.video_file = video_file
+        self.reference = None
+        self.lock = threading.Lock()
+
+    def align(self, audio_file):
+        """ :return: a tuple (offset in seconds the audio starts after the video, match score) """
+        with self.lock:
+            if self.reference is None:
+                self.reference = video_reference(self.video_file)
+        reference, reference_start = self.reference
+        return align_track(reference, reference_start, audio_file)
+
+    def offset(self, language, audio_file, min_score=MIN_ALIGN_SCORE):
+        """ The offset to mux a track with, 0 if it couldn't be aligned or the match isn't trusted """
+        try:
+            offset, score = self.align(audio_file)
+        except ffmpeg.Error as e:
+            logging.warning(f"Aligning {language} failed: {e}")
+            return 0.0
+        logging.info(f"==> {language}: offset {offset:+.3f}s, score {score:.2f}")
+        return offset if score >= min_score else 0.0
+
+
+def cached_reference(video_file):
+    """ The VideoReference of a video, decoded once per process for as long as the video doesn't change """
+    key = (os.path.abspath(video_file), os.path.getmtime(video_file))
+    with _references_lock:
+        if key in _references:
+            _references.move_to_end(key)
+        else:
+            _references[key] = VideoReference(video_file)
+            while len(_references) > MAX_CACHED_REFERENCES:
+                _references.popitem(last=False)
+        return _references[key]
+
+
+def align_tracks(video_file, audio_files, jobs=None):
+    """ Align every language track against the video's own audio
+    :param video_file: the shared_screen_with_speaker_view video
+    :param audio_files: a dict of language -> audio file
+    :return: a dict of language -> (offset in seconds, match score)
+    """
+    reference, reference_start = video_reference(video_file)
+    alignments = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            language: executor.submit(align_track, reference, reference_start, audio_file)
+            for language, audio_file in audio_files.items()
+        }
+        for language, future in futures.items():
+            try:
+                alignments[language] = future.result()
+            except ffmpeg.Error as e:
+                logging.warning(f"Aligning {language} failed: {e}")
+                alignments[language] = (0.0, 0.0)
+            offset, score = alignments[language]
+            logging.info(f"==> {language}: offset {offset:+.3f}s, score {score:.2f}")
+    return alignments
+
+
+def trusted_offsets(alignments, min_score=MIN_ALIGN_SCORE):
+    """ Keep the offsets whose match score is good enough to be applied
+    :return: a dict of language -> offset in seconds
+    """
+    return {language: offset for language, (offset, score) in alignments.items() if score >= min_score}
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_services import FAKE_ACCESS_TOKEN, SyntheticFile, serve_in_thread
+
+SCENARIOS = ("download", "download-segmented", "download-meeting", "upload-vimeo", "upload-youtube", "upload-s3", "startup")
+UPLOAD_FILE_NAME = "upload.mp4"
+MB = 1024 * 1024
+HEAVY_MODULES = ("requests", "tqdm", "ffmpeg", "numpy", "vimeo", "boto3")
+# the heavy libraries a cli command may load before it does anything, the rest must wait until used
+STARTUP_MODULES = {
+    None: (),
+    "download": ("requests", "tqdm"),
+    "mux": ("ffmpeg", "numpy"),
+    "upload-vimeo": ("requests", "vimeo"),
+    "upload-youtube": ("requests",),
+    "upload-s3": ("boto3",),
+    "pipeline": ("requests", "tqdm", "ffmpeg", "numpy"),
+    "webhook": ("requests", "tqdm"),
+    "jobs": (),
+}
+# seconds `cli.py <command> --help` may spend on imports, on top of the interpreter's own startup
+STARTUP_BUDGET = 0.5
+STARTUP_CODE = """
+import json, sys, time
+sys.path.insert(0, {repository!r})
+start = time.perf_counter()
+import cli
+try:
+    cli.main({argv!r})
+except SystemExit:
+    pass
+seconds = time.perf_counter() - start
+from benchmark import peak_rss
+print(json.dumps({{
+    "import_seconds": seconds,
+    "modules": [module for module in {heavy_modules!r} if module in sys.modules],
+    "peak_rss": peak_rss(),
+}}))
+"""
+
+
+def write_config(work_dir, base_url):
+    """ A downloader.conf pointing every service at the fake ones """
+    config = {
+        "zoom_oauth": {
+            "account_id": "benchmark", "client_id": "benchmark", "client_secret": "benchmark",
+            "oauth_url": f"{base_url}/oauth/token", "api_url": f"{base_url}/v2",
+        },
+        "vimeo": {
+            "client_id": "benchmark", "client_secret": "benchmark", "access_token": FAKE_ACCESS_TOKEN,
+            "api_root": f"{base_url}/vimeo",
+        },
+        "youtube_oauth": {
+            "client_id": "benchmark", "client_secret": "benchmark", "refresh_token": "benchmark",
+            "upload_url": f"{base_url}/youtube/upload", "token_url": f"{base_url}/youtube/token",
+        },
+        "s3": {
+            "bucket": "benchmark", "endpoint_url": f"{base_url}/s3", "region": "us-east-1",
+            "access_key_id": "benchmark", "secret_access_key": "benchmark",
+        },
+    }
+    config_file = os.path.join(work_dir, "downloader.conf")
+    with open(config_file, "w", encoding="utf-8") as json_file:
+        json.dump(config, json_file)
+    return config_file
+
+
+def write_upload_file(work_dir, size):
+    file_name = os.path.join(work_dir, UPLOAD_FILE_NAME)
+    with open(file_name, "wb") as upload_file:
+        for block in SyntheticFile(size, "upload").blocks(0, size):
+            upload_file.write(block)
+    return file_name
+
+
+def peak_rss():
+    """ The peak resident size in bytes of this process so far """
+    # ru_maxrss survives exec on Linux and would report the parent's peak, VmHWM starts over
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def usage():
+    """ The cpu seconds used and the peak resident size in bytes of this process so far """
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    return rusage.ru_utime + rusage.ru_stime, peak_rss()
+
+
+def run_scenario(scenario, options):
+    """ Run one scenario in this process, which runs nothing else
+    :return: a dict with the bytes moved, the wall and cpu seconds and the peak resident size
+    """
+    import metrics
+    work_dir = os.getcwd()
+    config_file = os.path.join(work_dir, "downloader.conf")
+    # checks the result once the transfer is timed, if the scenario can
+    verify = None
+
+    if scenario.startswith("download"):
+        import downloader
+        downloader.ZOOM_ACCESS_TOKEN = downloader.load_zoom_access_token()
+        recording = downloader.get_by_meeting_uuid("fake/meeting==0")
+        downloads = downloader.prepare_downloads(recording)
+        output_dir = os.path.join(work_dir, "downloads")
+        os.makedirs(output_dir, exist_ok=True)
+        if scenario != "download-meeting":
+            downloads = downloads[:1]
+        sizes = [download["file_size"] for download in recording["recording_files"]]
+        size = sizes[0] if scenario != "download-meeting" else sum(sizes)
+        segments = options["segments"] if scenario != "download" else 1
+
+        def run():
+            if scenario == "download-meeting":
+                return all(downloader.download_all(downloads, output_dir, options["jobs"], segments).values())
+            output_file_name, download_url, file_size = downloads[0]
+            return downloader.download_recording(
+                download_url, os.path.join(output_dir, output_file_name), segments=segments, file_size=file_size
+            )
+    else:
+        upload_file = os.path.join(work_dir, UPLOAD_FILE_NAME)
+        size = os.path.getsize(upload_file)
+        if scenario == "upload-vimeo":
+            from uploader import vimeouploader
+            vimeo_uploader = vimeouploader(options["chunk_size"], config_file=config_file)
+            # a finished upload is remembered next to the file, every run uploads it again
+            vimeo_uploader.remove_state(upload_file)
+
+            def run():
+                return vimeo_uploader.upload(upload_file, "Benchmark") is not None
+        elif scenario == "upload-s3":
+            import s3_uploader
+            from config import load_config
+            s3_config = load_config(config_file)["s3"]
+            client = s3_uploader.get_client(s3_config)
+            part_size = max(options["chunk_size"], s3_uploader.MIN_PART_SIZE)
+
+            def run():
+                results = s3_uploader.upload_files(
+                    client, s3_config["bucket"], [(upload_file, UPLOAD_FILE_NAME)], part_size, options["jobs"]
+                )
+                return all(results.values())
+
+            def verify():
+                # the fake computes the ETag from the parts it received, it must match the file's
+                return s3_uploader.is_unchanged(client, s3_config["bucket"], UPLOAD_FILE_NAME, upload_file, part_size)
+        else:
+            from youtube_uploader import youtubeuploader
+            youtube_uploader = youtubeuploader(options["chunk_size"], config_file=config_file)
+            # a finished upload is remembered next to the file, every run uploads it again
+            youtube_uploader.remove_state(upload_file)
+
+            def run():
+                return youtube_uploader.upload(upload_file, "Benchmark") is not None
+
+    cpu_before, rss_before = usage()
+    started = time.monotonic()
+    ok = run()
+    seconds = time.monotonic() - started
+    cpu_after, peak_rss = usage()
+    if ok and verify is not None:
+        ok = verify()
+    retries = sum(value for (name, _), value in metrics.METRICS.counters.items() if name in ("http_retries", "upload_retries"))
+    return {
+        "scenario": scenario,
+        "ok": bool(ok),
+        "bytes": size,
+        "seconds": round(seconds, 3),
+        "mb_per_s": round(size / MB / seconds, 1) if seconds else None,
+        "cpu_seconds": round(cpu_after - cpu_before, 3),
+        "cpu_percent": round(100 * (cpu_after - cpu_before) / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss / MB, 1),
+        "rss_growth_mb": round((peak_rss - rss_before) / MB, 1),
+        "retries": retries,
+    }
+
+
+def run_in_child(scenario, work_dir, options, verbose=False):
+    """ Run a scenario in a fresh interpreter so its peak RSS and cpu time are its own """
+    environment = dict(os.environ, HOME=work_dir)  # keep the token and folder caches out of the user's home
+    environment.pop("METRICS_TEXTFILE", None)
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--options", json.dumps(options)],
+        cwd=work_dir, env=environment, stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.DEVNULL, check=False,
+    )
+    lines = result.stdout.decode("utf-8", "replace").strip().splitlines()
+    if verbose:
+        print("\n".join(lines[:-1]))
+    if result.returncode != 0 or not lines:
+        return {"scenario": scenario, "ok": False, "error": f"exit status {result.returncode}"}
+    return json.loads(lines[-1])
+
+
+def measure_startup(command, budget=STARTUP_BUDGET):
+    """ Time `cli.py <command> --help` in a fresh interpreter and check the libraries it loaded
+    :param command: a cli command, None for the bare cli
+    :return: a dict with the import and wall seconds, the peak resident size and the heavy modules loaded
+    """
+    argv = [command, "--help"] if command else ["--help"]
+    code = STARTUP_CODE.format(
+        repository=os.path.dirname(os.path.abspath(__file__)), argv=argv, heavy_modules=HEAVY_MODULES
+    )
+    started = time.monotonic()
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+    seconds = time.monotonic() - started
+    measured = json.loads(result.stdout.decode("utf-8", "replace").strip().splitlines()[-1])
+    unexpected = [module for module in measured["modules"] if module not in STARTUP_MODULES[command]]
+    return {
+        "scenario": f"startup {command or 'cli'}",
+        "ok": measured["import_seconds"] <= budget and not unexpected,
+        "seconds": round(seconds, 3),
+        "import_seconds": round(measured["import_seconds"], 3),
+        "peak_rss_mb": round(measured["peak_rss"] / MB, 1),
+        "modules": " ".join(measured["modules"]) or "-",
+        "unexpected_modules": " ".join(unexpected) or "-",
+    }
+
+
+def print_results(results, columns):
+    print(" ".join(f"{column:>14}" for column in columns))
+    for result in results:
+        print(" ".join(f"{str(result.get(column, '-')):>14}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the download and upload paths against local fake services')
+    parser.add_argument('--scenarios', help='scenarios to run', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--size', help='size of the video file in MB', default=1024, type=float)
+    parser.add_argument('--latency', help='delay of every response in ms', default=0, type=float)
+    parser.add_argument('--bandwidth', help='bandwidth of every connection in MB/s, unlimited by default', default=None, type=float)
+    parser.add_argument('--error-rate', help='share of requests failing with 429 or 503', default=0.0, type=float)
+    parser.add_argument('--segments', help='byte ranges fetched in parallel by the segmented downloads', default=4, type=int)
+    parser.add_argument('--jobs', help='concurrent downloads of the meeting download and parts of the s3 upload', default=4, type=int)
+    parser.add_argument('--chunk-size', help='upload chunk size in MB', default=64, type=float)
+    parser.add_argument('--repeat', help='runs of every scenario', default=1, type=int)
+    parser.add_argument('--startup-budget', help='seconds a cli command may spend on imports', default=STARTUP_BUDGET, type=float)
+    parser.add_argument('--output', help='append the results as json lines to this file to compare runs')
+    parser.add_argument('--verbose', help='show the output of the scenarios', action='store_true')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, json.loads(args.options))))
+        return
+
+    size = int(args.size * MB)
+    options = {"segments": args.segments, "jobs": args.jobs, "chunk_size": int(args.chunk_size * MB)}
+    parameters = {
+        "size_mb": args.size, "latency_ms": args.latency, "bandwidth_mb_per_s": args.bandwidth,
+        "error_rate": args.error_rate, **options,
+    }
+    server = serve_in_thread(
+        size, latency=args.latency / 1000, bandwidth=args.bandwidth * MB if args.bandwidth else None,
+        error_rate=args.error_rate,
+    )
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="zoom-benchmark-") as work_dir:
+            write_config(work_dir, server.base_url)
+            if any(scenario.startswith("upload") for scenario in args.scenarios):
+                write_upload_file(work_dir, size)
+            for scenario in args.scenarios:
+                for _ in range(args.repeat):
+                    if scenario == "startup":
+                        results += [measure_startup(command, args.startup_budget) for command in STARTUP_MODULES]
+                        continue
+                    shutil.rmtree(os.path.join(work_dir, "downloads"), ignore_errors=True)
+                    results.append(run_in_child(scenario, work_dir, options, args.verbose))
+    finally:
+        server.shutdown()
+
+    transfers = [result for result in results if not result["scenario"].startswith("startup")]
+    startups = [result for result in results if result["scenario"].startswith("startup")]
+    if transfers:
+        print_results(transfers, (
+            "scenario", "ok", "mb_per_s", "seconds", "cpu_seconds", "cpu_percent", "peak_rss_mb", "rss_growth_mb", "retries"
+        ))
+    if startups:
+        print_results(startups, ("scenario", "ok", "import_seconds", "seconds", "peak_rss_mb", "modules", "unexpected_modules"))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as output_file:
+            for result in results:
+                output_file.write(json.dumps({"ts": time.time(), **parameters, **result}) + "\n")
+    if not all(result.get("ok") for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
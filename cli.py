@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import sys
+
+# subcommand -> (module, description), a module and the libraries it needs are only
+# imported once its subcommand runs, so every command starts as fast as it can
+COMMANDS = {
+    "download": ("downloader", "download zoom recordings by time, from a schedule or for a date range"),
+    "mux": ("mux", "mux the interpretation audio tracks of a meeting onto its video"),
+    "upload-vimeo": ("uploader", "upload videos to vimeo"),
+    "upload-youtube": ("youtube_uploader", "upload videos to youtube"),
+    "upload-s3": ("s3_uploader", "copy a meeting directory to s3"),
+    "pipeline": ("main", "download, mux and upload a meeting"),
+    "webhook": ("webhook", "download recordings as soon as zoom announces them"),
+    "jobs": ("jobs", "queue meetings and run their downloads, muxes and uploads with worker processes"),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        module_name, _ = COMMANDS[argv[0]]
+        # the subcommand's own parser sees the rest of the arguments
+        sys.argv[0] = f"{sys.argv[0]} {argv[0]}"
+        return importlib.import_module(module_name).main(argv[1:])
+
+    parser = argparse.ArgumentParser(description='zoom to youtube automation')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (_, description) in COMMANDS.items():
+        subparsers.add_parser(name, help=description, add_help=False)
+    parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main()
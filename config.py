@@ -0,0 +1,36 @@
+import json
+import os
+import threading
+
+CONF_FILE_NAME = "downloader.conf"
+# another config file can be chosen with this environment variable
+CONF_PATH_ENV = "ZOOM_DOWNLOADER_CONF"
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    pass
+
+
+def config_path():
+    return os.environ.get(CONF_PATH_ENV) or os.path.join(os.getcwd(), CONF_FILE_NAME)
+
+
+def load_config(path=None):
+    """ Read the config file on first use, later calls get the same dict
+    :param path: the config file, downloader.conf in the current directory by default
+    :raise ConfigError: if the file is missing or isn't valid json
+    """
+    path = path or config_path()
+    with _configs_lock:
+        if path not in _configs:
+            try:
+                with open(path, encoding="utf-8-sig") as json_file:
+                    _configs[path] = json.loads(json_file.read())
+            except FileNotFoundError:
+                raise ConfigError(f"Configuration file not found at {path}")
+            except json.JSONDecodeError:
+                raise ConfigError(f"Unable to decode JSON in configuration file {path}")
+        return _configs[path]
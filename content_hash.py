@@ -0,0 +1,58 @@
+import hashlib
+
+# the content hash of a file is the sha256 of the sha256 digests of its blocks, byte ranges that
+# start at a block boundary can then be hashed while they are downloaded in parallel
+HASH_BLOCK_SIZE = 8 * 1024 * 1024  # 8 Mebibytes
+READ_SIZE = 1024 * 1024
+
+
+class ContentHasher:
+    """ Hashes a file, or a range of it starting at a block boundary, as it is written """
+
+    def __init__(self):
+        self.digests = []
+        self.block = hashlib.sha256()
+        self.block_filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            size = min(len(view), HASH_BLOCK_SIZE - self.block_filled)
+            self.block.update(view[:size])
+            self.block_filled += size
+            view = view[size:]
+            if self.block_filled == HASH_BLOCK_SIZE:
+                self.digests.append(self.block.digest())
+                self.block = hashlib.sha256()
+                self.block_filled = 0
+
+    def block_digests(self):
+        if self.block_filled:
+            return self.digests + [self.block.digest()]
+        return list(self.digests)
+
+    def hexdigest(self):
+        return combine([self])
+
+
+def combine(hashers):
+    """ The content hash of a file from the hashers of its consecutive ranges """
+    return hashlib.sha256(b"".join(digest for hasher in hashers for digest in hasher.block_digests())).hexdigest()
+
+
+def hash_file(path, size=None, hasher=None):
+    """ Hash the first bytes of a file, e.g. the part of a download kept from an earlier attempt
+    :param size: the number of bytes to hash, the whole file by default
+    :param hasher: a ContentHasher to continue, a new one by default
+    :return: the ContentHasher
+    """
+    hasher = hasher or ContentHasher()
+    with open(path, "rb") as hashed_file:
+        while size is None or size > 0:
+            data = hashed_file.read(READ_SIZE if size is None else min(READ_SIZE, size))
+            if not data:
+                break
+            hasher.update(data)
+            if size is not None:
+                size -= len(data)
+    return hasher
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import base64
+import bisect
+import csv
 import json
 import os
 import requests
@@ -9,26 +11,23 @@ import argparse
 import sys
 import re
 import logging
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 import tqdm as progress_bar
 from urllib.parse import quote
+import metrics
+from config import ConfigError, load_config
+from content_hash import HASH_BLOCK_SIZE, ContentHasher, combine, hash_file
+from file_lock import locked
+from manifest import DownloadManifest
+from http_session import get_session
+from response_cache import RESPONSE_CACHE, cache_key
+from token_cache import get_access_token
 
-logging.basicConfig(level=logging.INFO)
-
-CONF_PATH = os.path.join(os.getcwd(), "downloader.conf")
-try:
-    with open(CONF_PATH, encoding="utf-8-sig") as json_file:
-        CONF = json.loads(json_file.read())
-except FileNotFoundError:
-    logging.info(f"Error: Configuration file not found at {CONF_PATH}")
-    sys.exit(1)
-except json.JSONDecodeError:
-    logging.info(f"Error: Unable to decode JSON in configuration file {CONF_PATH}")
-    sys.exit(1)
-
-ACCOUNT_ID = CONF["zoom_oauth"]["account_id"]
-CLIENT_ID = CONF["zoom_oauth"]["client_id"]
-CLIENT_SECRET = CONF["zoom_oauth"]["client_secret"]
+# zoom_oauth.oauth_url and zoom_oauth.api_url of the config file can point them at a local stand-in
+ZOOM_OAUTH_URL = "https://zoom.us/oauth/token"
+ZOOM_API_URL = "https://api.zoom.us/v2"
 
 AUDIO_FILE_RECORDING_START_TIME_FORMAT = r'%Y-%m-%dT%H:%M:%SZ'
 AUDIO_FILE_LANGUAGE_LIST = {
@@ -72,7 +71,14 @@ FILE_NAME_BY_RECORDING_TYPE = {
 }
 
 RECORDING_TIME_THRESHOLD = 30
+DEFAULT_DOWNLOAD_JOBS = 4
+PART_FILE_SUFFIX = ".part"
+SEGMENT_MIN_SIZE = 8 * 1024 * 1024  # 8 Mebibytes
 RECORDING_TIME_FORMAT = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$'
+RECORDING_DATE_FORMAT = '%Y-%m-%d'
+# the recordings listing accepts at most a month between from and to
+RECORDING_LIST_WINDOW_DAYS = 30
+RECORDING_LIST_PAGE_SIZE = 300
 
 class Color:
     CYAN = "\033[96m"
@@ -87,13 +93,19 @@ class Color:
 class ZoomOAuth:
     @staticmethod
     def get_account_id():
-        return CONF["zoom_oauth"]["account_id"]
+        return load_config()["zoom_oauth"]["account_id"]
     @staticmethod
     def get_client_id():
-        return CONF["zoom_oauth"]["client_id"]
+        return load_config()["zoom_oauth"]["client_id"]
     @staticmethod
     def get_client_secret():
-        return CONF["zoom_oauth"]["client_secret"]
+        return load_config()["zoom_oauth"]["client_secret"]
+    @staticmethod
+    def get_oauth_url():
+        return load_config()["zoom_oauth"].get("oauth_url", ZOOM_OAUTH_URL)
+    @staticmethod
+    def get_api_url():
+        return load_config()["zoom_oauth"].get("api_url", ZOOM_API_URL)
 
 def convert_response_to_json(response):
     try:
@@ -106,149 +118,656 @@ def convert_response_to_json(response):
         logging.error(f"Error decoding JSON response: {e}")
         return None
 
-def load_zoom_access_token():
+def request_zoom_access_token():
     """ OAuth function, thanks to https://github.com/freelimiter
+    :return: the token endpoint json with access_token and expires_in
     """
     zoom_oauth = ZoomOAuth()
     client_cred = f"{zoom_oauth.get_client_id()}:{zoom_oauth.get_client_secret()}"
     client_cred_base64_string = base64.b64encode(client_cred.encode("utf-8")).decode("utf-8")
-    response = requests.post(
-        url=f"https://zoom.us/oauth/token?grant_type=account_credentials&account_id={zoom_oauth.get_account_id()}",
-        headers = {
-            "Authorization": f"Basic {client_cred_base64_string}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-    )
-    response_json = convert_response_to_json(response)
-    if response_json is None:
-        return None
-    try:
-        return response_json["access_token"]
-    except KeyError:
-        logging.error(f"{Color.RED}### The key 'access_token' wasn't found.{Color.END}")
-        return None
+    with metrics.span("oauth") as span:
+        response = get_session().post(
+            url=f"{zoom_oauth.get_oauth_url()}?grant_type=account_credentials&account_id={zoom_oauth.get_account_id()}",
+            headers = {
+                "Authorization": f"Basic {client_cred_base64_string}",
+                "Content-Type": "application/x-www-form-urlencoded"
+            }
+        )
+        response_json = convert_response_to_json(response)
+        if response_json is None:
+            span.fail()
+    return response_json
 
-def get_recordings(recording_date, meeting_id):
-    """ Get all recordings for a given date and meeting id"""
-    response = requests.get(
-        url=f"https://api.zoom.us/v2/users/me/recordings?from={recording_date}&meeting_id={meeting_id}",
-        headers={
-            "Authorization": f"Bearer {ZOOM_ACCESS_TOKEN}",
+def load_zoom_access_token(stale_token=None):
+    """ Get an access token, reusing the one cached on disk until shortly before it expires
+    :param stale_token: a token the API rejected, a new one is fetched instead
+    """
+    return get_access_token(ZoomOAuth.get_account_id(), request_zoom_access_token, stale_token)
+
+ZOOM_ACCESS_TOKEN = None
+ZOOM_ACCESS_TOKEN_LOCK = threading.Lock()
+
+def refresh_zoom_access_token(stale_token):
+    """ Replace a rejected access token, only once even if several workers got a 401 """
+    global ZOOM_ACCESS_TOKEN
+    with ZOOM_ACCESS_TOKEN_LOCK:
+        if ZOOM_ACCESS_TOKEN == stale_token:
+            logging.info("==> Access token was rejected, refreshing it")
+            ZOOM_ACCESS_TOKEN = load_zoom_access_token(stale_token)
+        return ZOOM_ACCESS_TOKEN
+
+def zoom_get(url, headers=None, **kwargs):
+    """ GET a Zoom URL with the current access token, refreshing the token once on 401
+    Download URLs carry the token as access_token parameter, API calls as Bearer header.
+    """
+    def authorize(token):
+        if "access_token=" in url:
+            return re.sub(r"access_token=[^&]*", f"access_token={token}", url), headers
+        return url, {
+            **(headers or {}),
+            "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         }
-    )
-    return convert_response_to_json(response)
 
-def get_by_meeting_uuid(meeting_uuid):
-    """ Get the recording for a given meeting uuid"""
+    token = ZOOM_ACCESS_TOKEN
+    request_url, request_headers = authorize(token)
+    response = get_session().get(request_url, headers=request_headers, **kwargs)
+    if response.status_code == 401:
+        response.close()
+        metrics.count("token_refreshes", api="zoom")
+        token = refresh_zoom_access_token(token)
+        if token is not None:
+            request_url, request_headers = authorize(token)
+            response = get_session().get(request_url, headers=request_headers, **kwargs)
+    return response
+
+def iter_recordings(from_date, to_date=None, meeting_id=None):
+    """ Lazily list the recordings between two dates
+    The range is walked in windows of RECORDING_LIST_WINDOW_DAYS days and every window is
+    paged through with next_page_token, meetings are yielded as soon as their page arrives.
+    :param from_date: the first date, YYYY-MM-DD
+    :param to_date: the last date, YYYY-MM-DD, today if not given
+    :param meeting_id: an optional meeting id to filter the recordings
+    :return: a generator of meetings with their recording_files
+    :raise requests.RequestException: if a page couldn't be fetched
+    """
+    window_start = datetime.strptime(from_date, RECORDING_DATE_FORMAT).date()
+    last_date = datetime.strptime(to_date, RECORDING_DATE_FORMAT).date() if to_date else datetime.utcnow().date()
+    while window_start <= last_date:
+        window_end = min(window_start + timedelta(days=RECORDING_LIST_WINDOW_DAYS - 1), last_date)
+        params = {
+            "from": window_start.strftime(RECORDING_DATE_FORMAT),
+            "to": window_end.strftime(RECORDING_DATE_FORMAT),
+            "page_size": RECORDING_LIST_PAGE_SIZE,
+        }
+        if meeting_id:
+            params["meeting_id"] = meeting_id
+        while True:
+            with metrics.span("list_recordings", window=params["from"]) as span:
+                response = zoom_get(f"{ZoomOAuth.get_api_url()}/users/me/recordings", params=params)
+                response.raise_for_status()
+                span.add_bytes(len(response.content))
+                page = response.json()
+            yield from page.get("meetings", [])
+            if not page.get("next_page_token"):
+                break
+            params["next_page_token"] = page["next_page_token"]
+        window_start = window_end + timedelta(days=1)
+
+def get_recordings(recording_date, meeting_id):
+    """ Get all recordings for a given date and meeting id
+    The list of a past date is cached for a while, the uuids and start times are all that is used of it.
+    """
+    key = cache_key(ZoomOAuth.get_account_id(), f"{ZoomOAuth.get_api_url()}/users/me/recordings",
+                    {"date": recording_date, "meeting_id": meeting_id})
+    recordings = RESPONSE_CACHE.get(key)
+    if recordings is not None:
+        return recordings
+    # meetings close to midnight may be listed under the next day in the account's time zone
+    next_date = datetime.strptime(recording_date, RECORDING_DATE_FORMAT) + timedelta(days=1)
+    try:
+        recordings = {"meetings": list(iter_recordings(recording_date, next_date.strftime(RECORDING_DATE_FORMAT), meeting_id))}
+    except requests.RequestException as e:
+        logging.error(f"Error in API request: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON response: {e}")
+        return None
+    # a recording that isn't listed yet may be soon, only a found one is cached, and only once
+    # its days are over: a meeting of today can still finish after the listing was made
+    if recordings["meetings"] and next_date.date() < datetime.utcnow().date():
+        RESPONSE_CACHE.put(key, recordings)
+    return recordings
+
+def get_by_meeting_uuid(meeting_uuid, with_download_urls=True):
+    """ Get the recording for a given meeting uuid
+    :param meeting_uuid: the meeting uuid
+    :param with_download_urls: the download urls are needed, they are only cached in memory
+    """
 
     # double encode the UUID before making an API request
     # in case the UUID contains / or //
     encoded_meeting_uuid = quote(meeting_uuid, safe='')
     encoded_meeting_uuid = quote(encoded_meeting_uuid, safe='')
-    
-    response = requests.get(
-        url=f"https://api.zoom.us/v2/meetings/{encoded_meeting_uuid}/recordings",
-        headers={
-            "Authorization": f"Bearer {ZOOM_ACCESS_TOKEN}",
-            "Content-Type": "application/json"
-        }
-    )
+    url = f"{ZoomOAuth.get_api_url()}/meetings/{encoded_meeting_uuid}/recordings"
+    key = cache_key(ZoomOAuth.get_account_id(), url)
+    recording = RESPONSE_CACHE.get(key, with_secrets=with_download_urls)
+    if recording is not None:
+        return recording
 
-    return convert_response_to_json(response)
+    with metrics.span("get_meeting") as span:
+        response = zoom_get(url)
+        span.add_bytes(len(response.content))
+        recording = convert_response_to_json(response)
+        if recording is None:
+            span.fail()
+    if recording is not None:
+        RESPONSE_CACHE.put(key, recording)
+    return recording
 
-def prepare_downloads(recording):
+def recording_file_name(download):
+    """ The name a recording file is downloaded as
+    :param download: an entry of the recording_files of a recording
+    :return: the output file name, None for an unknown recording type or language
+    """
+    recording_type = download["recording_type"]
+    file_extension = download["file_extension"]
+    if recording_type not in FILE_NAME_BY_RECORDING_TYPE:
+        return None
+    if recording_type == RECORDING_TYPE_AUDIO_2:
+        audio_file_name = download["file_name"]
+        # if the audio file name contains parentheses,
+        # it means it's a translated audio file
+        # else it's the source audio file
+        audio_file_language_name = audio_file_name[audio_file_name.find("(")+1:audio_file_name.find(")")]
+        if audio_file_language_name not in AUDIO_FILE_LANGUAGE_LIST:
+            return None
+        return FILE_NAME_BY_RECORDING_TYPE.get(recording_type).format(AUDIO_FILE_LANGUAGE_LIST[audio_file_language_name], file_extension.lower())
+    return FILE_NAME_BY_RECORDING_TYPE.get(recording_type).format(file_extension.lower())
+
+def prepare_downloads(recording, manifest=None):
     """ Prepare the list of downloads for a given recording
     :param recording: the recording data
-    :return: a list of tuples (output_file_name, download_url)
+    :param manifest: an optional DownloadManifest, files it has as unchanged are skipped
+    :return: a list of tuples (output_file_name, download_url, file_size)
     """
     downloads = []
     for download in recording["recording_files"]:
         recording_type = download["recording_type"]
-        output_file_name = None
-        file_extension = download["file_extension"]
         if recording_type in FILE_NAME_BY_RECORDING_TYPE:
-            if recording_type == RECORDING_TYPE_AUDIO_2:
-                audio_file_name = download["file_name"]
-                # if the audio file name contains parentheses,
-                # it means it's a translated audio file
-                # else it's the source audio file
-                audio_file_language_name = audio_file_name[audio_file_name.find("(")+1:audio_file_name.find(")")]
-                if audio_file_language_name in AUDIO_FILE_LANGUAGE_LIST:
-                    output_file_name = FILE_NAME_BY_RECORDING_TYPE.get(recording_type).format(AUDIO_FILE_LANGUAGE_LIST[audio_file_language_name], file_extension.lower())
-            else:
-                output_file_name = FILE_NAME_BY_RECORDING_TYPE.get(recording_type).format(file_extension.lower())
+            output_file_name = recording_file_name(download)
+            if manifest is not None and output_file_name is not None:
+                if manifest.is_current(download, output_file_name):
+                    logging.info(f"{output_file_name} is unchanged. Skipping.")
+                    continue
+                manifest.track(download, output_file_name)
             # must append access token to download_url
             download_url = f"{download['download_url']}?access_token={ZOOM_ACCESS_TOKEN}"
-            downloads.append((output_file_name, download_url))
+            downloads.append((output_file_name, download_url, download.get("file_size")))
         else:
             logging.warning(f"Unknown recording type '{recording_type}'. Skipping.")
     return downloads
 
-def download_recording(download_url, full_filename):
+class DownloadProgress:
+    """ A single progress bar shared by every download worker.
+    The total grows as each worker learns its content-length.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bar = progress_bar.tqdm(total=0, unit="iB", unit_scale=True)
+
+    def add_total(self, size):
+        with self._lock:
+            self._bar.total += size
+            self._bar.refresh()
+
+    def update(self, size):
+        with self._lock:
+            self._bar.update(size)
+
+    def close(self):
+        self._bar.close()
+
+def get_ranged_size(download_url):
+    """ Ask for the first byte of a file to find out if the server supports ranges
+    :param download_url: the download URL
+    :return: the total file size if ranges are supported, None otherwise
+    """
+    response = zoom_get(download_url, headers={"Range": "bytes=0-0"}, stream=True)
+    response.close()
+    if response.status_code != 206:
+        return None
+    # Content-Range: bytes 0-0/<total size>
+    content_range = response.headers.get("content-range", "")
+    total_size = content_range.rpartition("/")[2]
+    if not total_size.isdigit():
+        return None
+    return int(total_size)
+
+class DownloadVerificationError(Exception):
+    """ A downloaded file doesn't have the size zoom reported, it is downloaded again on the next attempt """
+    pass
+
+def check_size(full_filename, size, file_size):
+    """ Compare the size of a download with the file_size of the recording file, if zoom reported one """
+    if file_size is not None and size != file_size:
+        raise DownloadVerificationError(f"'{full_filename}' has {size} bytes, zoom reported {file_size} bytes")
+
+def download_segment(download_url, part_filename, start, end, progress, written, hasher):
+    """ Download the byte range [start, end] of a file and write it at its offset
+    :param written: a list holding the number of bytes written for this segment
+    :param hasher: a ContentHasher for the range, which starts at a block boundary
+    """
+    response = zoom_get(download_url, headers={"Range": f"bytes={start}-{end}"}, stream=True)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise requests.RequestException(f"Range request for bytes {start}-{end} was not honoured")
+    block_size = 32 * 1024  # 32 Kibibytes
+    with open(part_filename, "r+b") as fd:
+        fd.seek(start)
+        for chunk in response.iter_content(block_size):
+            fd.write(chunk)
+            hasher.update(chunk)
+            written[0] += len(chunk)
+            progress.update(len(chunk))
+    if written[0] != end - start + 1:
+        raise requests.RequestException(f"Got {written[0]} of {end - start + 1} bytes for range {start}-{end}")
+
+def download_segmented(download_url, full_filename, part_filename, progress, segments, file_size=None):
+    """ Download a file as several byte ranges in parallel into a preallocated .part file
+    Every range is hashed while it is written, the ranges start at hash block boundaries.
+    :param file_size: the size zoom reported for the file
+    :return: the content hash, False if the download failed, None if the server doesn't support ranges
+    :raise DownloadVerificationError: if the server has another size for the file than zoom reported
+    """
+    total_size = get_ranged_size(download_url)
+    if total_size is None:
+        return None
+    check_size(full_filename, total_size, file_size)
+    segments = max(1, min(segments, total_size // SEGMENT_MIN_SIZE))
+    segment_size = -(-total_size // segments)
+    segment_size = max(1, -(-segment_size // HASH_BLOCK_SIZE)) * HASH_BLOCK_SIZE
+    ranges = [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+    written = [[0] for _ in ranges]
+    hashers = [ContentHasher() for _ in ranges]
+
+    with open(part_filename, "wb") as fd:
+        fd.truncate(total_size)  # preallocate
+    progress.add_total(total_size)
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(download_segment, download_url, part_filename, start, end, progress, written[idx], hashers[idx])
+            for idx, (start, end) in enumerate(ranges)
+        ]
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                errors.append(future.exception())
+    if errors:
+        # keep the leading run of complete segments so a later run can resume it
+        complete_size = 0
+        for (start, end), segment_written in zip(ranges, written):
+            if segment_written[0] != end - start + 1:
+                complete_size = start + segment_written[0]
+                break
+        with open(part_filename, "r+b") as fd:
+            fd.truncate(complete_size)
+        logging.error(f"{Color.RED}### Segmented download of '{full_filename}' failed: {errors[0]}{Color.END}")
+        return False
+    content_hash = combine(hashers)
+    os.replace(part_filename, full_filename)
+    return content_hash
+
+def download_recording(download_url, full_filename, progress=None, segments=1, file_size=None):
     """ Download a recording file
+    The size is checked against the content-length and the file_size zoom reported, and the file
+    is hashed in the same pass as it is written, see content_hash.
     :param download_url: the download URL
     :param full_filename: the full filename including the download directory
-    :return: True if the download was successful, False otherwise
+    :param progress: an optional shared DownloadProgress, a private bar is used otherwise
+    :param segments: the number of byte ranges to fetch in parallel, 1 for a single stream
+    :param file_size: the file_size of the recording file, if known
+    :return: the content hash of the downloaded file, None if the download failed
+    """
+    own_progress = progress is None
+    if own_progress:
+        progress = DownloadProgress()
+    part_filename = full_filename + PART_FILE_SUFFIX
+    # two downloads of the same file, e.g. of a repeated webhook event, must not append to one .part file
+    with locked(part_filename), metrics.span("download", file=full_filename) as span:
+        try:
+            if segments > 1 and not os.path.exists(part_filename):
+                result = download_segmented(download_url, full_filename, part_filename, progress, segments, file_size)
+                if result is not None:
+                    if result:
+                        span.add_bytes(os.path.getsize(full_filename))
+                        return result
+                    span.fail()
+                    return None
+                logging.info(f"Server doesn't support ranges for '{full_filename}', using a single stream")
+            # resume from whatever a previous attempt left in the .part file
+            offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            response = zoom_get(download_url, headers=headers, stream=True)
+            if response.status_code == 416:
+                # the .part file doesn't fit the remote file anymore, start over
+                response.close()
+                offset = 0
+                response = zoom_get(download_url, stream=True)
+            response.raise_for_status()
+            if response.status_code != 206:
+                # the server ignored the range, the body is the whole file
+                offset = 0
+
+            content_length = response.headers.get("content-length")
+            total_size = offset + int(content_length) if content_length is not None else None
+            if total_size is not None:
+                # don't download a file that can't be the one zoom listed
+                check_size(full_filename, total_size, file_size)
+            block_size = 32 * 1024  # 32 Kibibytes
+
+            # only the part kept from an earlier attempt is read back to hash it
+            hasher = hash_file(part_filename, offset) if offset else ContentHasher()
+            downloaded_size = offset
+            progress.add_total(total_size or 0)
+            progress.update(offset)
+            with open(part_filename, "ab" if offset else "wb") as fd:
+                for chunk in response.iter_content(block_size):
+                    span.first_byte()
+                    span.add_bytes(len(chunk))
+                    progress.update(len(chunk))
+                    fd.write(chunk)  # write video chunk to disk
+                    hasher.update(chunk)
+                    downloaded_size += len(chunk)
+
+            if total_size is not None and downloaded_size < total_size:
+                # the connection broke off, the next attempt continues from the .part file
+                logging.error(f"{Color.RED}### Incomplete download of '{full_filename}': {downloaded_size} of {total_size} bytes{Color.END}")
+                metrics.count("download_verification_failures", reason="incomplete")
+                span.fail()
+                return None
+            if total_size is not None and downloaded_size != total_size:
+                raise DownloadVerificationError(f"'{full_filename}' has {downloaded_size} bytes, the server sent a content-length of {total_size}")
+            check_size(full_filename, downloaded_size, file_size)
+            os.replace(part_filename, full_filename)
+            return hasher.hexdigest()
+
+        except DownloadVerificationError as e:
+            logging.error(f"{Color.RED}### Verification failed: {e}{Color.END}")
+            metrics.count("download_verification_failures", reason="size")
+            # the bytes can't be trusted, the next attempt starts over
+            if os.path.exists(part_filename):
+                os.remove(part_filename)
+        except requests.RequestException as e:
+            logging.error(f"{Color.RED}### Error in download request: {e}{Color.END}")
+        except OSError as e:
+            logging.error(f"{Color.RED}### The video recording with filename '{full_filename}' could not be written: {e}{Color.END}")
+        except Exception:
+            logging.exception(f"{Color.RED}### The video recording with filename '{full_filename}' could not be downloaded{Color.END}")
+        finally:
+            if own_progress:
+                progress.close()
+        span.fail()
+    return None
+
+def submit_downloads(executor, progress, downloads, output_dir, segments=1):
+    """ Submit a list of recordings to a download worker pool
+    :param executor: the worker pool
+    :param progress: the DownloadProgress shared by the workers
+    :param downloads: a list of tuples (output_file_name, download_url, file_size)
+    :param output_dir: the download directory
+    :param segments: the number of byte ranges to fetch in parallel for each file
+    :return: a dict of future -> output_file_name
+    """
+    futures = {}
+    for output_file_name, download_url, file_size in downloads:
+        if output_file_name is None:
+            logging.warning(f"No output file name for {download_url[0:64]}... Skipping.")
+            continue
+        full_filename = os.sep.join([output_dir, output_file_name])
+        truncated_url = download_url[0:64] + "..."
+        logging.info(
+            f"==> Downloading as {output_file_name}: "
+            f"{output_dir}: {truncated_url}"
+        )
+        future = executor.submit(download_recording, download_url, full_filename, progress, segments, file_size)
+        futures[future] = output_file_name
+    return futures
+
+def download_all(downloads, output_dir, jobs=DEFAULT_DOWNLOAD_JOBS, segments=1):
+    """ Download a list of recordings with a bounded pool of workers
+    :param downloads: a list of tuples (output_file_name, download_url, file_size)
+    :param output_dir: the download directory
+    :param jobs: the maximum number of concurrent downloads
+    :param segments: the number of byte ranges to fetch in parallel for each file
+    :return: a dict of output_file_name -> the content hash of the file, None if the download failed
     """
+    results = {}
+    progress = DownloadProgress()
     try:
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = submit_downloads(executor, progress, downloads, output_dir, segments)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        progress.close()
+    return results
 
-        total_size = int(response.headers.get("content-length", 0))
-        block_size = 32 * 1024  # 32 Kibibytes
+class RecordingTimeIndex:
+    """ The start times of a recordings listing, parsed once and kept sorted
+    so every lookup is a binary search instead of a scan of the listing.
+    """
+    def __init__(self, meetings):
+        entries = []
+        for meeting in meetings:
+            try:
+                start_time = datetime.strptime(meeting["start_time"], AUDIO_FILE_RECORDING_START_TIME_FORMAT)
+            except (KeyError, ValueError) as e:
+                logging.warning(f"{Color.RED}### Skipping recording with unparsable start time: {e}{Color.END}")
+                continue
+            entries.append((start_time, meeting["uuid"]))
+        entries.sort(key=lambda entry: entry[0])
+        self.start_times = [start_time for start_time, _ in entries]
+        self.uuids = [uuid for _, uuid in entries]
 
-        prog_bar = progress_bar.tqdm(total=total_size, unit="iB", unit_scale=True)
-        with open(full_filename, "wb") as fd:
-            for chunk in response.iter_content(block_size):
-                prog_bar.update(len(chunk))
-                fd.write(chunk)  # write video chunk to disk
-        prog_bar.close()
+    def find(self, recording_time):
+        """ Find the recording starting closest to a given time
+        :param recording_time: the recording time as datetime
+        :return: the recording uuid if it started within RECORDING_TIME_THRESHOLD minutes, None otherwise
+        """
+        position = bisect.bisect_left(self.start_times, recording_time)
+        closest = None
+        for candidate in (position - 1, position):
+            if 0 <= candidate < len(self.start_times):
+                delta = abs((self.start_times[candidate] - recording_time).total_seconds())
+                if closest is None or delta < closest[0]:
+                    closest = (delta, self.uuids[candidate])
+        if closest is None or closest[0] >= RECORDING_TIME_THRESHOLD * 60:
+            return None
+        return closest[1]
 
-    except requests.RequestException as e:
-        logging.error(f"{Color.RED}### Error in download request: {e}{Color.END}")
-    except Exception as e:
-        logging.error(f"{Color.RED}### The video recording with filename '{full_filename}{Color.END}' ")
-
-def time_delta(time1, time2):
-    """ Calculate the time delta between two times
-    :param time1: the first time
-    :param time2: the second time
-    :return: the time delta in minutes
+def get_recording_uuid(recordings, recording_time):
+    """ Get the recording uuid for a given recording time
+    :param recordings: the list of recordings for a give date, or a RecordingTimeIndex built from it
+    :param recording_time: the recording time
+    :return: the uuid of the closest recording within the threshold
     """
+    if not isinstance(recordings, RecordingTimeIndex):
+        recordings = RecordingTimeIndex(recordings["meetings"])
     try:
-        time1 = datetime.strptime(time1, '%Y-%m-%dT%H:%M:%SZ')
-        time2 = datetime.strptime(time2, '%Y-%m-%dT%H:%M:%SZ')
-        return abs(int((time1 - time2).total_seconds()/60))
+        recording_time = datetime.strptime(recording_time, AUDIO_FILE_RECORDING_START_TIME_FORMAT)
     except ValueError as e:
         logging.warning(f"{Color.RED}### Error parsing datetime strings: {e}{Color.END}")
         return None
+    return recordings.find(recording_time)
 
-def get_recording_uuid(recordings, recording_time):
-    """ Get the recording uuid for a given recording time
-    :param recordings: the list of recordings for a give date
-    :param recording_time: the recording time
-    :return: the recording uuid
+def load_schedule(schedule_path):
+    """ Load a batch schedule
+    :param schedule_path: a .csv file with a meetingid,time,dir header or a .jsonl file with the same keys
+    :return: a list of dicts with the keys meetingid, time and dir
     """
-    for recording in recordings["meetings"]:
-        recording_time_delta = time_delta(recording["start_time"], recording_time)
-        if recording_time_delta is None:
-            return None
-        if recording_time_delta < RECORDING_TIME_THRESHOLD:
-            return recording["uuid"]
-    return None
+    with open(schedule_path, encoding="utf-8-sig", newline="") as schedule_file:
+        if schedule_path.lower().endswith(".jsonl"):
+            entries = [json.loads(line) for line in schedule_file if line.strip()]
+        else:
+            entries = list(csv.DictReader(schedule_file))
+    return [
+        {key: str(entry.get(key, "")).strip() for key in ("meetingid", "time", "dir")}
+        for entry in entries
+    ]
 
-def main():
+def run_batch(schedule, jobs=DEFAULT_DOWNLOAD_JOBS, segments=1):
+    """ Download the recordings of many (meeting id, time) pairs with one worker pool
+    Recordings are listed once per date and meeting id.
+    :param schedule: a list of dicts with the keys meetingid, time and dir
+    :param jobs: the maximum number of concurrent downloads
+    :param segments: the number of byte ranges to fetch in parallel for each file
+    :return: a list of the entries or files that failed
+    """
+    failed = []
+    groups = {}
+    for entry in schedule:
+        if not re.match(RECORDING_TIME_FORMAT, entry["time"]) or not entry["meetingid"] or not entry["dir"]:
+            logging.warning(f"⚠ Invalid schedule entry {entry}. Skipping.")
+            failed.append(f"{entry['meetingid']}@{entry['time']}")
+            continue
+        recording_date = entry["time"].split("T")[0]
+        groups.setdefault((recording_date, entry["meetingid"]), []).append(entry)
+
+    manifests = {}
+    recording_files = {}
+    futures = {}
+    submitted = {}
+    progress = DownloadProgress()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for (recording_date, meeting_id), entries in groups.items():
+                # get list recordings for the day once for every entry of the group
+                recordings = get_recordings(recording_date, meeting_id)
+                if recordings is None:
+                    logging.warning(f"⚠ No recording with the meeting id {meeting_id} found for the given time {recording_date}")
+                    failed.extend(f"{meeting_id}@{entry['time']}" for entry in entries)
+                    continue
+                recordings = RecordingTimeIndex(recordings["meetings"])
+                for entry in entries:
+                    meeting_uuid = get_recording_uuid(recordings, entry["time"])
+                    if meeting_uuid is None:
+                        logging.warning(f"⚠ No recording found for the given time {entry['time']}")
+                        failed.append(f"{meeting_id}@{entry['time']}")
+                        continue
+                    if meeting_uuid not in recording_files:
+                        recording_files[meeting_uuid] = get_by_meeting_uuid(meeting_uuid)
+                    recording = recording_files[meeting_uuid]
+                    if recording is None:
+                        failed.append(f"{meeting_id}@{entry['time']}")
+                        continue
+                    output_dir = entry["dir"]
+                    os.makedirs(output_dir, exist_ok=True)
+                    if output_dir not in manifests:
+                        manifests[output_dir] = DownloadManifest(output_dir)
+                    # a directory holds the files of one meeting, an entry repeating it is only downloaded once
+                    file_names = {recording_file_name(download) for download in recording["recording_files"]} - {None}
+                    owners = {submitted.get((output_dir, file_name)) for file_name in file_names} - {None}
+                    if owners - {meeting_uuid}:
+                        logging.warning(f"⚠ The recording for {entry['time']} would overwrite another meeting's files in {output_dir}")
+                        failed.append(f"{meeting_id}@{entry['time']}")
+                        continue
+                    if owners:
+                        continue
+                    submitted.update(((output_dir, file_name), meeting_uuid) for file_name in file_names)
+                    downloads = prepare_downloads(recording, manifests[output_dir])
+                    for future, output_file_name in submit_downloads(executor, progress, downloads, output_dir, segments).items():
+                        futures[future] = (output_dir, output_file_name)
+            for future in as_completed(futures):
+                output_dir, output_file_name = futures[future]
+                content_hash = future.result()
+                if content_hash:
+                    manifests[output_dir].mark_done(output_file_name, content_hash)
+                else:
+                    failed.append(os.sep.join([output_dir, output_file_name]))
+    finally:
+        progress.close()
+        for manifest in manifests.values():
+            manifest.save()
+    return failed
+
+def meeting_output_dir(output_dir, meeting):
+    """ The directory a meeting's recordings are downloaded to, named after its start time """
+    return os.path.join(output_dir, meeting["start_time"].replace(":", "-"))
+
+def run_backfill(from_date, to_date, meeting_id, output_dir, jobs=DEFAULT_DOWNLOAD_JOBS, segments=1):
+    """ Download every recording between two dates into one directory per meeting
+    Downloads of the first meetings start while later pages are still being listed.
+    :return: a list of the files that failed
+    """
+    failed = []
+    manifests = {}
+    futures = {}
+    progress = DownloadProgress()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            try:
+                for meeting in iter_recordings(from_date, to_date, meeting_id):
+                    if not meeting.get("recording_files"):
+                        continue
+                    meeting_dir = meeting_output_dir(output_dir, meeting)
+                    os.makedirs(meeting_dir, exist_ok=True)
+                    manifest = manifests.setdefault(meeting_dir, DownloadManifest(meeting_dir))
+                    downloads = prepare_downloads(meeting, manifest)
+                    for future, output_file_name in submit_downloads(executor, progress, downloads, meeting_dir, segments).items():
+                        futures[future] = (meeting_dir, output_file_name)
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                logging.error(f"{Color.RED}### Listing the recordings failed: {e}{Color.END}")
+                failed.append(f"listing {from_date}..{to_date or 'today'}")
+            for future in as_completed(futures):
+                meeting_dir, output_file_name = futures[future]
+                content_hash = future.result()
+                if content_hash:
+                    manifests[meeting_dir].mark_done(output_file_name, content_hash)
+                else:
+                    failed.append(os.sep.join([meeting_dir, output_file_name]))
+    finally:
+        progress.close()
+        for manifest in manifests.values():
+            manifest.save()
+    return failed
+
+def main(argv=None):
     global ZOOM_ACCESS_TOKEN
-    ZOOM_ACCESS_TOKEN = load_zoom_access_token()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='zoom video file downloader')
+    parser.add_argument('--time', help='meeting video recoring time', type=str)
+    parser.add_argument('--meetingid', help='zoom meeting id', type=str)
+    parser.add_argument('--dir', help='Output file path')
+    parser.add_argument('--batch', help='schedule .csv or .jsonl file with meetingid, time and dir for each recording')
+    parser.add_argument('--from', dest='from_date', help='backfill every recording from this date, YYYY-MM-DD')
+    parser.add_argument('--to', dest='to_date', help='last date of the backfill, YYYY-MM-DD, today if not given')
+    parser.add_argument('--jobs', help='number of concurrent downloads', default=DEFAULT_DOWNLOAD_JOBS, type=int)
+    parser.add_argument('--segments', help='number of parallel byte ranges per file', default=1, type=int)
+    args = parser.parse_args(argv)
+    try:
+        ZOOM_ACCESS_TOKEN = load_zoom_access_token()
+    except ConfigError as e:
+        logging.error(f"Error: {e}")
+        sys.exit(1)
     if ZOOM_ACCESS_TOKEN is None:
         logging.error("Failed to get zoom api access token")
         exit(1)
-    parser = argparse.ArgumentParser(description='zoom video file downloader')
-    parser.add_argument('--time', help='meeting video recoring time', required=True, type=str)
-    parser.add_argument('--meetingid', help='zoom meeting id', required=True, type=str)
-    parser.add_argument('--dir', help='Output file path', required=True)
-    args = parser.parse_args()
+    if args.batch or args.from_date:
+        if args.batch:
+            failed = run_batch(load_schedule(args.batch), args.jobs, args.segments)
+        elif args.dir:
+            failed = run_backfill(args.from_date, args.to_date, args.meetingid, args.dir, args.jobs, args.segments)
+        else:
+            parser.error("--dir is required with --from")
+        if failed:
+            logging.error(f"{Color.RED}### {len(failed)} downloads failed: {', '.join(sorted(failed))}{Color.END}")
+            exit(1)
+        logging.info("Done!")
+        return
+    if not (args.time and args.meetingid and args.dir):
+        parser.error("--time, --meetingid and --dir are required without --batch or --from")
     recording_time = args.time
     meeting_id = args.meetingid
     output_dir = args.dir
@@ -273,17 +792,19 @@ def main():
         exit(1)
     # get list of downloads for the meeting uuid
     logging.info("==> Preparing downloads...")
-    downloads = prepare_downloads(get_by_meeting_uuid(meeting_uuid))
-    # download each recording
-    for output_file_name, download_url in downloads:
-        full_filename = os.sep.join([output_dir, output_file_name])
-        truncated_url = download_url[0:64] + "..."
-        logging.info(
-            f"==> Downloading as {output_file_name}: "
-            f"{output_dir}: {truncated_url}"
-        )
-        download_recording(download_url, full_filename)
-    logging.info("Done!")   
+    manifest = DownloadManifest(output_dir)
+    downloads = prepare_downloads(get_by_meeting_uuid(meeting_uuid), manifest)
+    # download the recordings with a bounded pool of workers
+    results = download_all(downloads, output_dir, args.jobs, args.segments)
+    for output_file_name, content_hash in results.items():
+        if content_hash:
+            manifest.mark_done(output_file_name, content_hash)
+    manifest.save()
+    failed = [output_file_name for output_file_name, content_hash in results.items() if not content_hash]
+    if failed:
+        logging.error(f"{Color.RED}### {len(failed)} of {len(results)} downloads failed: {', '.join(sorted(failed))}{Color.END}")
+        exit(1)
+    logging.info("Done!")
 
 if __name__ == "__main__":
     # tell Python to shutdown gracefully when SIGINT is received
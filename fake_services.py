@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+
+DEFAULT_PORT = 8089
+FAKE_ACCESS_TOKEN = "fake-access-token"
+# the synthetic files repeat a pseudo random pattern of this size
+PATTERN_SIZE = 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+LANGUAGES = ("English", "Français", "Deutsch")
+MEETINGS_START = datetime(2024, 1, 1, 18, 0, 0)
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+# the fake S3 endpoint is {base_url}/s3 with path-style bucket and key
+S3_OBJECT_PATTERN = re.compile(r"/s3/([^/]+)/(.+)")
+S3_XML_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class SyntheticFile:
+    """ A file that is never stored, its bytes are generated from the seed for any range """
+
+    def __init__(self, size, seed):
+        self.size = size
+        pattern = random.Random(seed).randbytes(PATTERN_SIZE)
+        # any block up to PATTERN_SIZE long is one slice of the doubled pattern
+        self.pattern = pattern + pattern
+
+    def blocks(self, start, end):
+        """ The bytes of [start, end) in blocks of at most BLOCK_SIZE """
+        while start < end:
+            size = min(BLOCK_SIZE, end - start)
+            offset = start % PATTERN_SIZE
+            yield self.pattern[offset:offset + size]
+            start += size
+
+
+class FakeServices(ThreadingHTTPServer):
+    """ A local stand-in for the Zoom API and downloads, for the Vimeo and YouTube upload endpoints
+    and for the S3 object and multipart upload calls, the uploaded bytes are only hashed, never stored.
+    Every response can be delayed, every body is paced to a bandwidth cap per connection,
+    and a share of the requests fail with 429 or 503 to exercise the retries.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, file_size, meetings=3, latency=0.0, bandwidth=None, error_rate=0.0, seed=0):
+        """
+        :param file_size: the size of every meeting's video in bytes, the audio tracks are a tenth of it
+        :param meetings: the number of meetings listed
+        :param latency: seconds every response is delayed by
+        :param bandwidth: bytes per second of every response and upload body, unlimited if None
+        :param error_rate: the share of API, download and upload requests answered with 429 or 503
+        """
+        super().__init__(address, FakeServicesHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.meetings = []
+        self.uploads = {}
+        # (bucket, key) -> {"size", "etag", "part_sizes"} and upload id -> {"bucket", "key", "parts"}
+        self.s3_objects = {}
+        self.s3_uploads = {}
+        self.received_bytes = 0
+        for index in range(meetings):
+            self.meetings.append(self.make_meeting(index, file_size))
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def make_meeting(self, index, file_size):
+        start_time = (MEETINGS_START + timedelta(days=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        meeting = {
+            "uuid": f"fake/meeting=={index}",
+            "id": 1000 + index,
+            "topic": f"Fake meeting {index}",
+            "start_time": start_time,
+            "duration": 60,
+            "recording_files": [],
+        }
+        tracks = [("shared_screen_with_speaker_view", "MP4", "Recording", file_size)]
+        tracks += [("audio_interpretation", "M4A", f"Audio interpretation ({language})", max(1, file_size // 10)) for language in LANGUAGES]
+        for track, (recording_type, extension, file_name, size) in enumerate(tracks):
+            file_id = f"{index}-{track}"
+            self.files[file_id] = SyntheticFile(size, f"{index}-{track}")
+            meeting["recording_files"].append({
+                "id": file_id,
+                "meeting_id": meeting["uuid"],
+                "recording_start": start_time,
+                "recording_end": start_time,
+                "file_type": extension,
+                "file_extension": extension,
+                "file_name": file_name,
+                "file_size": size,
+                "recording_type": recording_type,
+                "status": "completed",
+                "download_url": f"{self.base_url}/rec/download/{file_id}",
+            })
+        return meeting
+
+    def should_fail(self):
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            return self.random.choice((429, 503))
+
+    def new_upload(self, size):
+        with self.lock:
+            upload_id = str(len(self.uploads) + 1)
+            self.uploads[upload_id] = {"size": size, "offset": 0}
+            return upload_id
+
+
+class FakeServicesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def paced(self, blocks):
+        """ Pace a sequence of blocks to the bandwidth cap of the server """
+        started = time.monotonic()
+        sent = 0
+        for block in blocks:
+            yield block
+            sent += len(block)
+            if self.server.bandwidth:
+                ahead = sent / self.server.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def read_body(self, digest=None):
+        """ Read and discard the request body, paced like the responses
+        :param digest: an optional hash object the body is fed to
+        :return: the number of bytes read
+        """
+        remaining = int(self.headers.get("Content-Length", 0))
+
+        def blocks():
+            nonlocal remaining
+            while remaining:
+                block = self.rfile.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+
+        size = 0
+        for block in self.paced(blocks()):
+            size += len(block)
+            if digest is not None:
+                digest.update(block)
+        with self.server.lock:
+            self.server.received_bytes += size
+        return size
+
+    def begin(self, may_fail=True):
+        """ Delay the response and maybe fail it
+        :return: True if the request should be answered normally
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status = self.server.should_fail() if may_fail else None
+        if status is None:
+            return True
+        self.read_body()
+        self.send_empty(status, {"Retry-After": "0"} if status == 429 else None)
+        return False
+
+    def authorized(self, query):
+        if self.headers.get("Authorization") == f"Bearer {FAKE_ACCESS_TOKEN}":
+            return True
+        if query.get("access_token", [None])[0] == FAKE_ACCESS_TOKEN:
+            return True
+        self.read_body()
+        self.send_json(401, {"code": 124, "message": "Invalid access token."})
+        return False
+
+    def send_xml(self, status, root, children, headers=None):
+        """ Answer with an S3 style XML document of one element holding text elements """
+        body = "".join(f"<{name}>{value}</{name}>" for name, value in children)
+        data = f'<?xml version="1.0" encoding="UTF-8"?>\n<{root} xmlns="{S3_XML_NAMESPACE}">{body}</{root}>'.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def s3_not_found(self, code="NoSuchKey"):
+        if self.command == "HEAD":
+            return self.send_empty(404)
+        self.send_xml(404, "Error", [("Code", code), ("Message", "The specified resource does not exist.")])
+
+    def s3_request(self, bucket, key, query):
+        """ PutObject, HeadObject and the create, upload part, complete and abort calls of a multipart upload """
+        if not self.begin(may_fail=self.command == "PUT"):
+            return
+        upload_id = query.get("uploadId", [None])[0]
+        if self.command == "HEAD":
+            stored = self.server.s3_objects.get((bucket, key))
+            if stored is None:
+                return self.s3_not_found()
+            size = stored["size"]
+            if "partNumber" in query:
+                part_number = int(query["partNumber"][0])
+                if part_number > len(stored["part_sizes"]):
+                    return self.send_empty(416)
+                size = stored["part_sizes"][part_number - 1]
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.send_header("ETag", f'"{stored["etag"]}"')
+            self.end_headers()
+            return
+        if self.command == "POST" and "uploads" in query:
+            self.read_body()
+            with self.server.lock:
+                upload_id = f"fake-upload-{len(self.server.s3_uploads) + 1}"
+                self.server.s3_uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+            return self.send_xml(200, "InitiateMultipartUploadResult", [("Bucket", bucket), ("Key", key), ("UploadId", upload_id)])
+        if upload_id is not None and upload_id not in self.server.s3_uploads:
+            self.read_body()
+            return self.s3_not_found("NoSuchUpload")
+        if self.command == "PUT":
+            digest = hashlib.md5()
+            size = self.read_body(digest)
+            if upload_id is None:
+                with self.server.lock:
+                    self.server.s3_objects[(bucket, key)] = {"size": size, "etag": digest.hexdigest(), "part_sizes": [size]}
+            else:
+                with self.server.lock:
+                    self.server.s3_uploads[upload_id]["parts"][int(query["partNumber"][0])] = (size, digest.digest())
+            return self.send_empty(200, {"ETag": f'"{digest.hexdigest()}"'})
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length", 0))
+            document = ElementTree.fromstring(self.rfile.read(length))
+            part_numbers = [int(part.findtext("{*}PartNumber")) for part in document.findall(".//{*}Part")]
+            with self.server.lock:
+                upload = self.server.s3_uploads.pop(upload_id)
+                if any(number not in upload["parts"] for number in part_numbers):
+                    self.server.s3_uploads[upload_id] = upload
+                    return self.send_xml(400, "Error", [("Code", "InvalidPart"), ("Message", "A part was not uploaded.")])
+                parts = [upload["parts"][number] for number in part_numbers]
+                etag = f"{hashlib.md5(b''.join(digest for _, digest in parts)).hexdigest()}-{len(parts)}"
+                self.server.s3_objects[(bucket, key)] = {
+                    "size": sum(size for size, _ in parts), "etag": etag, "part_sizes": [size for size, _ in parts],
+                }
+            return self.send_xml(200, "CompleteMultipartUploadResult", [("Bucket", bucket), ("Key", key), ("ETag", f"&quot;{etag}&quot;")])
+        if self.command == "DELETE" and upload_id is not None:
+            with self.server.lock:
+                self.server.s3_uploads.pop(upload_id, None)
+            return self.send_empty(204)
+        self.read_body()
+        self.send_xml(405, "Error", [("Code", "MethodNotAllowed"), ("Message", "Not supported by the fake.")])
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        match = S3_OBJECT_PATTERN.fullmatch(url.path)
+        if match:
+            return self.s3_request(match.group(1), unquote(match.group(2)), parse_qs(url.query, keep_blank_values=True))
+        if url.path in ("/oauth/token", "/youtube/token"):
+            if not self.begin(may_fail=False):
+                return
+            self.read_body()
+            return self.send_json(200, {"access_token": FAKE_ACCESS_TOKEN, "token_type": "bearer", "expires_in": 3600})
+        if not self.begin(may_fail=False) or not self.authorized(parse_qs(url.query)):
+            return
+        if url.path == "/vimeo/me/videos":
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            upload_id = self.server.new_upload(int(request["upload"]["size"]))
+            return self.send_json(201, {
+                "uri": f"/videos/{upload_id}",
+                "upload": {"approach": "tus", "upload_link": f"{self.server.base_url}/tus/{upload_id}"},
+            })
+        if url.path == "/youtube/upload":
+            self.read_body()
+            upload_id = self.server.new_upload(int(self.headers["X-Upload-Content-Length"]))
+            return self.send_empty(200, {"Location": f"{self.server.base_url}/youtube/session/{upload_id}"})
+        self.read_body()
+        self.send_json(404, {"message": "Not found"})
+
+    def do_HEAD(self):
+        url = urlparse(self.path)
+        match = S3_OBJECT_PATTERN.fullmatch(url.path)
+        if match:
+            return self.s3_request(match.group(1), unquote(match.group(2)), parse_qs(url.query, keep_blank_values=True))
+        match = re.fullmatch(r"/tus/(\d+)", url.path)
+        if match and match.group(1) in self.server.uploads:
+            upload = self.server.uploads[match.group(1)]
+            return self.send_empty(200, {"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["size"])})
+        self.send_empty(404)
+
+    def do_PATCH(self):
+        url = urlparse(self.path)
+        match = re.fullmatch(r"/tus/(\d+)", url.path)
+        if not match or match.group(1) not in self.server.uploads:
+            self.read_body()
+            return self.send_empty(404)
+        if not self.begin():
+            return
+        upload = self.server.uploads[match.group(1)]
+        if int(self.headers.get("Upload-Offset", -1)) != upload["offset"]:
+            self.read_body()
+            return self.send_empty(409)
+        upload["offset"] += self.read_body()
+        self.send_empty(204, {"Upload-Offset": str(upload["offset"])})
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        match = S3_OBJECT_PATTERN.fullmatch(url.path)
+        if match:
+            return self.s3_request(match.group(1), unquote(match.group(2)), parse_qs(url.query, keep_blank_values=True))
+        match = re.fullmatch(r"/youtube/session/(\d+)", url.path)
+        if not match or match.group(1) not in self.server.uploads:
+            self.read_body()
+            return self.send_empty(404)
+        content_range = self.headers.get("Content-Range", "")
+        if not self.begin(may_fail=not content_range.startswith("bytes */")):
+            return
+        upload = self.server.uploads[match.group(1)]
+        chunk = CONTENT_RANGE_PATTERN.fullmatch(content_range)
+        if chunk:
+            if int(chunk.group(1)) != upload["offset"]:
+                self.read_body()
+                return self.send_empty(400)
+            upload["offset"] += self.read_body()
+        else:
+            self.read_body()
+        if upload["offset"] >= upload["size"]:
+            return self.send_json(200, {"id": f"fake-video-{match.group(1)}"})
+        headers = {"Range": f"bytes=0-{upload['offset'] - 1}"} if upload["offset"] else {}
+        self.send_empty(308, headers)
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        match = S3_OBJECT_PATTERN.fullmatch(url.path)
+        if match:
+            return self.s3_request(match.group(1), unquote(match.group(2)), parse_qs(url.query, keep_blank_values=True))
+        self.read_body()
+        self.send_json(404, {"message": "Not found"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/vimeo/videos":
+            uris = query.get("uris", [""])[0].split(",")
+            return self.send_json(200, {"data": [{"uri": uri, "transcode": {"status": "complete"}} for uri in uris if uri]})
+        if not self.begin() or not self.authorized(query):
+            return
+        if url.path == "/v2/users/me/recordings":
+            return self.list_recordings(query)
+        match = re.fullmatch(r"/v2/meetings/(.+)/recordings", url.path)
+        if match:
+            meeting_uuid = unquote(unquote(match.group(1)))
+            for meeting in self.server.meetings:
+                if meeting_uuid in (meeting["uuid"], str(meeting["id"])):
+                    return self.send_json(200, meeting)
+            return self.send_json(404, {"code": 3301, "message": "This recording does not exist."})
+        match = re.fullmatch(r"/rec/download/([\w-]+)", url.path)
+        if match and match.group(1) in self.server.files:
+            return self.send_file(self.server.files[match.group(1)])
+        self.send_json(404, {"message": "Not found"})
+
+    def list_recordings(self, query):
+        first = query.get("from", ["0000-00-00"])[0]
+        last = query.get("to", ["9999-99-99"])[0]
+        meetings = [meeting for meeting in self.server.meetings if first <= meeting["start_time"][:10] <= last]
+        page_size = int(query.get("page_size", ["30"])[0])
+        start = int(query.get("next_page_token", ["0"])[0] or 0)
+        page = meetings[start:start + page_size]
+        next_page_token = str(start + page_size) if start + page_size < len(meetings) else ""
+        self.send_json(200, {
+            "from": first, "to": last, "page_size": page_size, "total_records": len(meetings),
+            "next_page_token": next_page_token, "meetings": page,
+        })
+
+    def send_file(self, synthetic_file):
+        start, end = 0, synthetic_file.size
+        status = 200
+        match = RANGE_PATTERN.fullmatch(self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1, synthetic_file.size) if match.group(2) else synthetic_file.size
+            else:
+                start = max(0, synthetic_file.size - int(match.group(2)))
+            if start >= synthetic_file.size or start >= end:
+                return self.send_empty(416, {"Content-Range": f"bytes */{synthetic_file.size}"})
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{synthetic_file.size}")
+        self.end_headers()
+        try:
+            for block in self.paced(synthetic_file.blocks(start, end)):
+                self.wfile.write(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve_in_thread(file_size, port=0, **options):
+    """ Start the fake services on a background thread
+    :return: the running FakeServices, call shutdown() to stop it
+    """
+    server = FakeServices(("127.0.0.1", port), file_size, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='local stand-in for the zoom api and the upload endpoints')
+    parser.add_argument('--port', help='port to listen on', default=DEFAULT_PORT, type=int)
+    parser.add_argument('--size', help='size of every meeting video in MB', default=1024, type=float)
+    parser.add_argument('--meetings', help='number of meetings', default=3, type=int)
+    parser.add_argument('--latency', help='delay of every response in ms', default=0, type=float)
+    parser.add_argument('--bandwidth', help='bandwidth of every connection in MB/s', default=None, type=float)
+    parser.add_argument('--error-rate', help='share of requests failing with 429 or 503', default=0.0, type=float)
+    args = parser.parse_args()
+    server = FakeServices(
+        ("127.0.0.1", args.port), int(args.size * 1024 * 1024), args.meetings, args.latency / 1000,
+        args.bandwidth * 1024 * 1024 if args.bandwidth else None, args.error_rate
+    )
+    logging.info(f"Serving fake zoom, vimeo and youtube endpoints on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the lock is then a no-op
+    fcntl = None
+
+
+@contextmanager
+def locked(path):
+    """ Hold an exclusive lock on <path>.lock while the block runs, other processes taking it wait
+    :param path: the file the lock protects, its directory is created if needed
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
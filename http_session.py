@@ -0,0 +1,124 @@
+import email.utils
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# (connect, read) timeouts in seconds, the read timeout is the longest gap between two bytes
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1.0
+# no request waits longer than this between two attempts, a longer Retry-After is not waited for
+MAX_BACKOFF = 60
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+POOL_SIZE = 32
+
+# stay under the Zoom API quota, requests per second and burst size
+DEFAULT_RATE = 10
+DEFAULT_BURST = 20
+
+
+class TokenBucket:
+    """ A thread safe token bucket, acquire() blocks until a token is available """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_retry_after(response):
+    """ Read the Retry-After header of a response
+    :return: the number of seconds to wait, or None if the header is missing or invalid
+    """
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return int(retry_after)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, retry_at.timestamp() - time.time())
+
+
+class RetrySession(requests.Session):
+    """ A pooled keep-alive session with default timeouts, rate limiting and
+    exponential backoff on connection errors, 429 and 5xx responses.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, rate_limiter=None):
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = rate_limiter
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def backoff(self, attempt):
+        return min(MAX_BACKOFF, self.backoff_factor * (2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                metrics.count("http_retries", reason=type(e).__name__)
+                logging.warning(f"{method} {url[0:64]}... failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response)
+                if retry_after is not None and retry_after > MAX_BACKOFF:
+                    # a worker isn't held up for longer than that, the caller sees the response instead
+                    logging.warning(f"{method} {url[0:64]}... returned {response.status_code}, "
+                                    f"not waiting the {retry_after:.0f}s of its Retry-After")
+                    return response
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                metrics.count("http_retries", reason=str(response.status_code))
+                logging.warning(f"{method} {url[0:64]}... returned {response.status_code}, retrying in {delay:.1f}s")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """ Get the session shared by every Zoom request of the process """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = RetrySession(rate_limiter=TokenBucket(DEFAULT_RATE, DEFAULT_BURST))
+        return _session
@@ -0,0 +1,274 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# downloads and uploads wait on the network, muxes on the cpu, each pool has its own workers
+IO_POOL = "io"
+CPU_POOL = "cpu"
+DEFAULT_MAX_ATTEMPTS = 3
+# a claimed job goes back to the queue if its worker doesn't renew the lease in time
+LEASE_SECONDS = 120
+# a failed attempt is retried after RETRY_DELAY * 2 ** (attempts - 1) seconds
+RETRY_DELAY = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, pool, run_after);
+CREATE TABLE IF NOT EXISTS job_dependencies (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    depends_on TEXT NOT NULL,
+    PRIMARY KEY (job_id, depends_on)
+);
+"""
+
+
+def worker_name(pid=None):
+    """ Identifies the process holding a lease, the pid tells whether it is still alive """
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+class Job:
+    """ A claimed job, the payload is the dict given to JobQueue.enqueue """
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.key = row["key"]
+        self.kind = row["kind"]
+        self.pool = row["pool"]
+        self.payload = json.loads(row["payload"])
+        self.attempts = row["attempts"]
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.key!r}, attempt {self.attempts})"
+
+
+class JobQueue:
+    """ A durable job queue in a SQLite file, shared by the worker processes of one machine.
+    A job is queued, running under a lease, done or failed after its last attempt.
+    A job only becomes claimable once every job it depends on is done, and fails with them.
+    Every process opens its own JobQueue, a connection is not shared between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        # readers don't block the writer and the other way round
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """ Take the write lock right away so that a claim can't race another worker's """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def enqueue(self, key, kind, pool, payload, depends_on=(), max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """ Add a job unless a job with the same key was ever added
+        :param key: identifies the work, e.g. the file to download
+        :param kind: the handler that runs the job
+        :param pool: IO_POOL or CPU_POOL
+        :param payload: a json serializable dict for the handler
+        :param depends_on: the keys of the jobs that must be done first, they must be enqueued already
+        :return: True if the job was added
+        """
+        with self.transaction() as connection:
+            return self.insert(connection, key, kind, pool, payload, depends_on, max_attempts)
+
+    @staticmethod
+    def insert(connection, key, kind, pool, payload, depends_on=(), max_attempts=DEFAULT_MAX_ATTEMPTS):
+        now = time.time()
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO jobs (key, kind, pool, payload, max_attempts, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, pool, json.dumps(payload), max_attempts, now, now),
+        )
+        if cursor.rowcount == 0:
+            return False
+        connection.executemany(
+            "INSERT OR IGNORE INTO job_dependencies (job_id, depends_on) VALUES (?, ?)",
+            [(cursor.lastrowid, dependency) for dependency in depends_on],
+        )
+        return True
+
+    def claim(self, pools, owner, lease_seconds=LEASE_SECONDS):
+        """ Atomically take the oldest runnable job of the pools, including jobs whose worker died
+        :param pools: the pools this worker serves
+        :param owner: the name of the worker, see worker_name
+        :return: a Job or None if there is nothing to do right now
+        """
+        now = time.time()
+        placeholders = ",".join("?" * len(pools))
+        with self.transaction() as connection:
+            # a job that ran out of attempts while its worker was dead is not tried again
+            connection.execute(
+                "UPDATE jobs SET state = ?, last_error = 'lease expired', lease_owner = NULL, updated_at = ?"
+                " WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (FAILED, now, RUNNING, now),
+            )
+            self.fail_dependents(connection, now)
+            row = connection.execute(
+                f"SELECT * FROM jobs WHERE pool IN ({placeholders}) AND run_after <= ?"
+                " AND (state = ? OR (state = ? AND lease_expires < ?))"
+                " AND NOT EXISTS (SELECT 1 FROM job_dependencies dependency"
+                "   LEFT JOIN jobs required ON required.key = dependency.depends_on"
+                "   WHERE dependency.job_id = jobs.id AND (required.state IS NULL OR required.state != ?))"
+                " ORDER BY id LIMIT 1",
+                (*pools, now, QUEUED, RUNNING, now, DONE),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?,"
+                " updated_at = ? WHERE id = ?",
+                (RUNNING, owner, now + lease_seconds, now, row["id"]),
+            )
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return Job(row)
+
+    def renew(self, job, owner, lease_seconds=LEASE_SECONDS):
+        """ Extend the lease of a running job
+        :return: False if the lease was lost to another worker
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                (now + lease_seconds, now, job.id, RUNNING, owner),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job, owner, follow_ups=()):
+        """ Mark a job as done and add the jobs it planned in the same transaction
+        :param follow_ups: a list of dicts with the arguments of enqueue
+        :return: False if the lease was lost, the follow-ups are then left to the new owner
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, last_error = NULL,"
+                " updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                (DONE, now, job.id, RUNNING, owner),
+            )
+            if cursor.rowcount != 1:
+                return False
+            for follow_up in follow_ups:
+                self.insert(connection, **follow_up)
+        return True
+
+    def fail(self, job, owner, error):
+        """ Put a job back into the queue after a delay, or fail it and its dependents after its last attempt
+        :return: True if the job will be retried
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?",
+                (job.id, RUNNING, owner),
+            ).fetchone()
+            if row is None:
+                return False
+            retry = row["attempts"] < row["max_attempts"]
+            connection.execute(
+                "UPDATE jobs SET state = ?, run_after = ?, lease_owner = NULL, lease_expires = NULL,"
+                " last_error = ?, updated_at = ? WHERE id = ?",
+                (QUEUED if retry else FAILED, now + RETRY_DELAY * 2 ** (row["attempts"] - 1), str(error), now, job.id),
+            )
+            self.fail_dependents(connection, now)
+        return retry
+
+    def release(self, job, owner):
+        """ Give a job back without counting the attempt, e.g. when the worker is stopped """
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts - 1, lease_owner = NULL, lease_expires = NULL,"
+                " updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                (QUEUED, time.time(), job.id, RUNNING, owner),
+            )
+
+    def release_owner(self, owner):
+        """ Let the jobs of a worker known to be dead be claimed right away instead of after their lease """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = 0 WHERE state = ? AND lease_owner = ?", (RUNNING, owner)
+            )
+        return cursor.rowcount
+
+    def owners(self):
+        """ The workers holding a lease """
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT lease_owner FROM jobs WHERE state = ?", (RUNNING,)
+        )]
+
+    @staticmethod
+    def fail_dependents(connection, now):
+        """ Fail the queued jobs that wait for a failed job, and the jobs waiting for them """
+        while True:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = ?, last_error = 'a job it depends on failed', updated_at = ?"
+                " WHERE state = ? AND id IN (SELECT dependency.job_id FROM job_dependencies dependency"
+                "   JOIN jobs required ON required.key = dependency.depends_on WHERE required.state = ?)",
+                (FAILED, now, QUEUED, FAILED),
+            )
+            if cursor.rowcount == 0:
+                return
+
+    def retry_failed(self):
+        """ Queue the failed jobs again with fresh attempts
+        :return: the number of jobs queued again
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, run_after = 0, updated_at = ? WHERE state = ?",
+                (QUEUED, time.time(), FAILED),
+            )
+        return cursor.rowcount
+
+    def unfinished(self):
+        """ The number of jobs that are queued or running """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchone()[0]
+
+    def counts(self):
+        """ {(kind, state): number of jobs} """
+        return {
+            (row["kind"], row["state"]): row["count"]
+            for row in self.connection.execute("SELECT kind, state, COUNT(*) AS count FROM jobs GROUP BY kind, state")
+        }
+
+    def failures(self):
+        """ The key and last error of every failed job """
+        return [(row["key"], row["last_error"]) for row in self.connection.execute(
+            "SELECT key, last_error FROM jobs WHERE state = ? ORDER BY id", (FAILED,)
+        )]
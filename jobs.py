@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+import metrics
+from job_queue import CPU_POOL, IO_POOL, LEASE_SECONDS, JobQueue, worker_name
+
+JOBS_DB_FILE_NAME = "jobs.sqlite3"
+DEFAULT_IO_WORKERS = 4
+# seconds an idle worker waits before it looks for a job again
+POLL_INTERVAL = 2
+# a runner stops replacing workers that die after this many replacements
+MAX_WORKER_RESTARTS = 10
+UPLOAD_DESTINATIONS = ("none", "vimeo", "youtube")
+
+
+class JobFailed(Exception):
+    pass
+
+
+def download_key(output_dir, file_name):
+    return f"download {os.path.join(output_dir, file_name)}"
+
+
+def mux_key(output_dir, language):
+    return f"mux {output_dir} {language}"
+
+
+def upload_key(destination, output_dir, language):
+    return f"upload {destination} {output_dir} {language}"
+
+
+def meeting_job(meeting_id, recording_time, output_dir, upload="none", segments=1):
+    """ The arguments of JobQueue.enqueue for the job that plans the work of a meeting
+    :param meeting_id: the zoom meeting id
+    :param recording_time: the recording time, YYYY-MM-DDTHH:MM:SSZ
+    :param output_dir: the directory of the downloads and the muxed videos
+    :param upload: where to upload the muxed videos, one of UPLOAD_DESTINATIONS
+    :param segments: the number of byte ranges to fetch in parallel for each file
+    """
+    output_dir = os.path.abspath(output_dir)
+    return {
+        "key": f"meeting {meeting_id} {recording_time} {output_dir}",
+        "kind": "meeting",
+        "pool": IO_POOL,
+        "payload": {
+            "meeting_id": meeting_id, "time": recording_time, "output_dir": output_dir,
+            "upload": upload, "segments": segments,
+        },
+    }
+
+
+def zoom_downloader():
+    """ The downloader module with an access token for this worker """
+    import downloader
+    if downloader.ZOOM_ACCESS_TOKEN is None:
+        downloader.ZOOM_ACCESS_TOKEN = downloader.load_zoom_access_token()
+        if downloader.ZOOM_ACCESS_TOKEN is None:
+            raise JobFailed("Failed to get zoom api access token")
+    return downloader
+
+
+def get_recording(meeting_uuid, with_download_urls=True):
+    recording = zoom_downloader().get_by_meeting_uuid(meeting_uuid, with_download_urls)
+    if recording is None:
+        raise JobFailed(f"The recording of {meeting_uuid} couldn't be fetched")
+    return recording
+
+
+def run_meeting(payload):
+    """ Find the recording of a meeting and plan a download for every file,
+    a mux for every language once the video and its audio are downloaded,
+    and an upload for every muxed video
+    """
+    import mux
+    downloader = zoom_downloader()
+    recordings = downloader.get_recordings(payload["time"].split("T")[0], payload["meeting_id"])
+    if recordings is None:
+        raise JobFailed(f"The recordings of {payload['meeting_id']} couldn't be listed")
+    meeting_uuid = downloader.get_recording_uuid(recordings, payload["time"])
+    if meeting_uuid is None:
+        raise JobFailed(f"No recording of {payload['meeting_id']} found for the given time {payload['time']}")
+    recording = get_recording(meeting_uuid)
+
+    output_dir = payload["output_dir"]
+    file_names = [output_file_name for output_file_name, _, _ in downloader.prepare_downloads(recording) if output_file_name]
+    jobs = [{
+        "key": download_key(output_dir, file_name),
+        "kind": "download",
+        "pool": IO_POOL,
+        "payload": {
+            "meeting_uuid": meeting_uuid, "output_dir": output_dir, "file_name": file_name,
+            "segments": payload.get("segments", 1),
+        },
+    } for file_name in file_names]
+    if mux.VIDEO_FILE_NAME not in file_names:
+        logging.warning(f"⚠ The recording of {payload['meeting_id']} has no {mux.VIDEO_FILE_NAME}, nothing to mux")
+        return jobs
+    for file_name in file_names:
+        match = mux.AUDIO_FILE_PATTERN.match(file_name)
+        if not match:
+            continue
+        language = match.group(1)
+        jobs.append({
+            "key": mux_key(output_dir, language),
+            "kind": "mux",
+            "pool": CPU_POOL,
+            "payload": {"output_dir": output_dir, "language": language, "audio_file": file_name},
+            "depends_on": [download_key(output_dir, mux.VIDEO_FILE_NAME), download_key(output_dir, file_name)],
+        })
+        if payload.get("upload", "none") != "none":
+            jobs.append({
+                "key": upload_key(payload["upload"], output_dir, language),
+                "kind": "upload",
+                "pool": IO_POOL,
+                "payload": {
+                    "meeting_uuid": meeting_uuid, "output_dir": output_dir, "language": language,
+                    "destination": payload["upload"],
+                },
+                "depends_on": [mux_key(output_dir, language)],
+            })
+    return jobs
+
+
+def run_download(payload):
+    """ Download one file of a recording, the manifest of the directory is updated right away """
+    from manifest import DownloadManifest
+    downloader = zoom_downloader()
+    # the download urls of the recording are cached by this worker for a while
+    recording = get_recording(payload["meeting_uuid"])
+    output_dir = payload["output_dir"]
+    file_name = payload["file_name"]
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = DownloadManifest(output_dir)
+    downloads = {
+        output_file_name: (download_url, file_size)
+        for output_file_name, download_url, file_size in downloader.prepare_downloads(recording, manifest)
+    }
+    if file_name not in downloads:
+        if os.path.isfile(os.path.join(output_dir, file_name)):
+            return []
+        raise JobFailed(f"{file_name} is no longer part of the recording")
+    full_filename = os.path.join(output_dir, file_name)
+    download_url, file_size = downloads[file_name]
+    content_hash = downloader.download_recording(
+        download_url, full_filename, segments=payload.get("segments", 1), file_size=file_size
+    )
+    if not content_hash:
+        raise JobFailed(f"Downloading {full_filename} failed")
+    manifest.save_done(file_name, content_hash)
+    return []
+
+
+def run_mux(payload):
+    """ Align and mux one language onto the video """
+    import ffmpeg
+    import mux
+    output_dir = payload["output_dir"]
+    language = payload["language"]
+    audio_file = os.path.join(output_dir, payload["audio_file"])
+    video_file = os.path.join(output_dir, mux.VIDEO_FILE_NAME)
+    with metrics.span("mux", language=language) as span:
+        try:
+            output_file = mux.mux_track(video_file, language, audio_file, output_dir)
+        except ffmpeg.Error as e:
+            raise JobFailed(f"Muxing {language} failed: {e.stderr.decode('utf-8', 'replace') if e.stderr else e}")
+        if output_file is None:
+            raise JobFailed(f"{audio_file} has no audio stream to mux")
+        span.add_bytes(os.path.getsize(output_file))
+    logging.info(f"==> Muxed {language}: {output_file}")
+    return []
+
+
+def run_upload(payload):
+    """ Upload one muxed video, titled after the zoom recording """
+    import mux
+    from main import get_uploader
+    # only the topic and times are needed, the copy of the recording cached on disk will do
+    recording = get_recording(payload["meeting_uuid"], with_download_urls=False)
+    video_file = os.path.join(payload["output_dir"], mux.OUTPUT_FILE_NAME.format(payload["language"]))
+    if not get_uploader(payload["destination"], recording)(payload["language"], video_file):
+        raise JobFailed(f"Uploading {video_file} to {payload['destination']} failed")
+    return []
+
+
+HANDLERS = {
+    "meeting": run_meeting,
+    "download": run_download,
+    "mux": run_mux,
+    "upload": run_upload,
+}
+
+
+def keep_lease(db_path, job, owner, stop):
+    """ Renew the lease of a running job until it is finished """
+    queue = JobQueue(db_path)
+    try:
+        while not stop.wait(LEASE_SECONDS / 3):
+            if not queue.renew(job, owner):
+                logging.warning(f"Lost the lease of {job}")
+                return
+    finally:
+        queue.close()
+
+
+def work(db_path, pools, forever=False, slot=None):
+    """ Claim and run the jobs of some pools, a worker process of the runner
+    :param db_path: the job queue file
+    :param pools: the pools to take jobs from
+    :param forever: keep waiting for new jobs when the queue is empty
+    :param slot: the name of the worker in the runner, e.g. io-0, it keeps its metrics in a textfile of its own
+    """
+    logging.basicConfig(level=logging.INFO)
+    if slot:
+        metrics.METRICS.per_process(slot)
+    owner = worker_name()
+    queue = JobQueue(db_path)
+    try:
+        while True:
+            job = queue.claim(pools, owner)
+            if job is None:
+                if not forever and queue.unfinished() == 0:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            logging.info(f"==> {owner} runs {job.key}, attempt {job.attempts}")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=keep_lease, args=(db_path, job, owner, stop), daemon=True)
+            heartbeat.start()
+            try:
+                follow_ups = HANDLERS[job.kind](job.payload)
+            except KeyboardInterrupt:
+                queue.release(job, owner)
+                return
+            except Exception as e:
+                retry = queue.fail(job, owner, e)
+                logging.error(f"### {job.key} failed{', retrying later' if retry else ''}: {e}")
+                metrics.count("jobs", kind=job.kind, result="retried" if retry else "failed")
+            else:
+                queue.complete(job, owner, follow_ups)
+                metrics.count("jobs", kind=job.kind, result="done")
+            finally:
+                stop.set()
+                heartbeat.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def release_dead_workers(queue):
+    """ Let the jobs left running by dead workers of this machine be claimed right away """
+    hostname = socket.gethostname()
+    for owner in queue.owners():
+        host, _, pid = owner.rpartition(":")
+        if host == hostname and pid.isdigit() and not is_alive(int(pid)):
+            released = queue.release_owner(owner)
+            logging.info(f"==> Resuming {released} jobs of the stopped worker {owner}")
+
+
+def run_workers(db_path, io_workers=DEFAULT_IO_WORKERS, cpu_workers=None, forever=False):
+    """ Run the queued jobs with worker processes, downloads and uploads in one pool and muxes in another
+    Jobs left running by a crash are resumed, and a worker that dies is replaced.
+    :param db_path: the job queue file
+    :param io_workers: the number of processes running downloads and uploads
+    :param cpu_workers: the number of processes running muxes, the number of cores by default
+    :param forever: keep the workers waiting for new jobs
+    :return: the keys and errors of the failed jobs
+    """
+    queue = JobQueue(db_path)
+    release_dead_workers(queue)
+    context = multiprocessing.get_context("spawn")
+
+    def start(pools, slot):
+        process = context.Process(target=work, args=(db_path, pools, forever, slot), name=f"jobs-{slot}")
+        process.start()
+        return process
+
+    # a replacement takes the slot of the worker it replaces, and with it its metrics textfile
+    slots = [((IO_POOL,), f"{IO_POOL}-{index}") for index in range(max(1, io_workers))]
+    slots += [((CPU_POOL,), f"{CPU_POOL}-{index}") for index in range(max(1, cpu_workers or os.cpu_count()))]
+    workers = [(pools, slot, start(pools, slot)) for pools, slot in slots]
+    restarts = 0
+    try:
+        while workers:
+            time.sleep(1)
+            running = []
+            for pools, slot, process in workers:
+                if process.is_alive():
+                    running.append((pools, slot, process))
+                elif process.exitcode != 0:
+                    logging.warning(f"⚠ Worker {process.pid} stopped with exit code {process.exitcode}")
+                    queue.release_owner(worker_name(process.pid))
+                    if restarts < MAX_WORKER_RESTARTS:
+                        restarts += 1
+                        running.append((pools, slot, start(pools, slot)))
+            workers = running
+    except KeyboardInterrupt:
+        # the workers got the interrupt too, they give their jobs back before they stop
+        logging.info("==> Stopping the workers")
+        for _, _, process in workers:
+            process.join()
+    failures = queue.failures()
+    queue.close()
+    return failures
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='queue meetings and download, mux and upload them with worker processes')
+    parser.add_argument('--db', help='job queue file', default=JOBS_DB_FILE_NAME)
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    add_parser = subparsers.add_parser('add', help='queue a meeting or every meeting of a schedule')
+    add_parser.add_argument('--time', help='meeting video recoring time')
+    add_parser.add_argument('--meetingid', help='zoom meeting id')
+    add_parser.add_argument('--dir', help='Output file path')
+    add_parser.add_argument('--batch', help='schedule .csv or .jsonl file with meetingid, time and dir for each recording')
+    add_parser.add_argument('--upload', help='where to upload the mixed videos', choices=UPLOAD_DESTINATIONS, default='none')
+    add_parser.add_argument('--segments', help='number of parallel byte ranges per file', default=1, type=int)
+    run_parser = subparsers.add_parser('run', help='run the queued jobs until the queue is empty')
+    run_parser.add_argument('--io-workers', help='processes for downloads and uploads', default=DEFAULT_IO_WORKERS, type=int)
+    run_parser.add_argument('--cpu-workers', help='processes for muxes, the number of cores by default', type=int)
+    run_parser.add_argument('--forever', help='keep waiting for new jobs', action='store_true')
+    subparsers.add_parser('status', help='count the jobs by kind and state and list the failed ones')
+    subparsers.add_parser('retry', help='queue the failed jobs again')
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.command == "add":
+        from downloader import RECORDING_TIME_FORMAT, load_schedule
+        if args.batch:
+            schedule = load_schedule(args.batch)
+        elif args.time and args.meetingid and args.dir:
+            schedule = [{"meetingid": args.meetingid, "time": args.time, "dir": args.dir}]
+        else:
+            parser.error("--time, --meetingid and --dir are required without --batch")
+        for entry in schedule:
+            if not re.match(RECORDING_TIME_FORMAT, entry["time"]) or not entry["meetingid"] or not entry["dir"]:
+                logging.warning(f"⚠ Invalid schedule entry {entry}. Skipping.")
+                continue
+            if not queue.enqueue(**meeting_job(entry["meetingid"], entry["time"], entry["dir"], args.upload, args.segments)):
+                logging.info(f"{entry['meetingid']}@{entry['time']} is already queued")
+    elif args.command == "run":
+        queue.close()
+        failures = run_workers(args.db, args.io_workers, args.cpu_workers, args.forever)
+        if failures:
+            logging.error(f"### {len(failures)} jobs failed: {', '.join(key for key, _ in failures)}")
+            sys.exit(1)
+        logging.info("Done!")
+    elif args.command == "status":
+        for (kind, state), count in sorted(queue.counts().items()):
+            print(f"{kind:>10} {state:>10} {count:>6}")
+        for key, error in queue.failures():
+            # the end of an ffmpeg error says what went wrong
+            print(f"### {key}: {error.strip().splitlines()[-1] if error and error.strip() else error}")
+    elif args.command == "retry":
+        logging.info(f"==> {queue.retry_failed()} failed jobs queued again")
+
+
+if __name__ == "__main__":
+    main()
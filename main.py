@@ -1,40 +1,23 @@
 #!/usr/bin/env python3
 
 # system libraries
-import base64
-import json
+import functools
 import os
-#import re as regex
 import signal
 import sys as system
 from datetime import datetime
 
 # installed libraries
 import argparse
-import dateutil.parser as parser
-import pathvalidate as path_validate
-import requests
-import tqdm as progress_bar
-import ffmpeg
-from pydub import AudioSegment
-from moviepy.editor import VideoFileClip
-from youtube_upload.client import YoutubeUploader
-
-CONF_PATH = "downloader.conf"
-with open(CONF_PATH, encoding="utf-8-sig") as json_file:
-    CONF = json.loads(json_file.read())
-
-ACCOUNT_ID = CONF["zoom_oauth"]["account_id"]
-CLIENT_ID = CONF["zoom_oauth"]["client_id"]
-CLIENT_SECRET = CONF["zoom_oauth"]["client_secret"]
 
-DOWNLOAD_DIRECTORY = 'downloads'
+# local modules
+import downloader
+import mux
+from config import ConfigError
+from manifest import DownloadManifest
+from pipeline import Pipeline, VIDEO_TRACK
 
-YOUTUBE_CATEGORY = "27"
-YOUTUBE_CLIENT_ID = CONF["youtube_oauth"]["client_id"]
-YOUTUBE_CLIENT_SECRET = CONF["youtube_oauth"]["client_secret"]
-GOOGLE_OAUTH_ACCESS_TOKEN = CONF["youtube_oauth"]["access_token"]
-GOOGLE_OAUTH_REFRESH_TOKEN = CONF["youtube_oauth"]["refresh_token"]
+DOWNLOAD_DIRECTORY = 'downloads'
 
 AUDIO_FILE_RECORDING_START_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 AUDIO_FILE_LANGUAGE_LIST = {
@@ -76,33 +59,16 @@ class Color:
     END = "\033[0m"
 
 
-def load_access_token():
-    """ OAuth function, thanks to https://github.com/freelimiter
+def load_access_token(stale_token=None):
+    """ Load the access token, reusing the one cached on disk until shortly before it expires
+    :param stale_token: a token the API rejected, a new one is fetched instead
     """
-    url = f"https://zoom.us/oauth/token?grant_type=account_credentials&account_id={ACCOUNT_ID}"
-
-    client_cred = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    client_cred_base64_string = base64.b64encode(client_cred.encode("utf-8")).decode("utf-8")
-
-    headers = {
-        "Authorization": f"Basic {client_cred_base64_string}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-
-    response = json.loads(requests.request("POST", url, headers=headers).text)
-
-    global ACCESS_TOKEN
-    global AUTHORIZATION_HEADER
-
-    try:
-        ACCESS_TOKEN = response["access_token"]
-        AUTHORIZATION_HEADER = {
-            "Authorization": f"Bearer {ACCESS_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        #print(ACCESS_TOKEN)
-    except KeyError:
+    access_token = downloader.load_zoom_access_token(stale_token)
+    if access_token is None:
         print(f"{Color.RED}### The key 'access_token' wasn't found.{Color.END}")
+        return
+    # the downloads and API calls share the token of the downloader, which also refreshes it on 401
+    downloader.ZOOM_ACCESS_TOKEN = access_token
 
 def format_filename(params):
     file_name = None
@@ -117,7 +83,7 @@ def format_filename(params):
         f"{file_name}.{file_extension.lower()}"
     )
 
-def get_downloads(recording):
+def get_downloads(recording, manifest=None):
     if not recording.get("recording_files"):
         raise Exception
     downloads = []
@@ -135,137 +101,116 @@ def get_downloads(recording):
                 output_file_name = f"source-audio.{file_extension.lower()}"
                 if audio_file_language_name in AUDIO_FILE_LANGUAGE_LIST:
                     directory_name = f"audio-{AUDIO_FILE_LANGUAGE_LIST[audio_file_language_name]}"
+            # skip files the manifest already has unchanged on disk
+            if manifest is not None:
+                relative_path = os.path.normpath(os.path.join(directory_name, output_file_name))
+                if manifest.is_current(download, relative_path):
+                    print(f"{relative_path} is unchanged. Skipping.")
+                    continue
+                manifest.track(download, relative_path)
             # must append access token to download_url
-            download_url = f"{download['download_url']}?access_token={ACCESS_TOKEN}"
-            downloads.append((download["recording_start"], output_file_name, directory_name, download_url))
+            download_url = f"{download['download_url']}?access_token={downloader.ZOOM_ACCESS_TOKEN}"
+            downloads.append((download["recording_start"], output_file_name, directory_name, download_url, download.get("file_size")))
     return downloads
 
-def download_recording(download_url, download_dir, full_filename):
-
-    os.makedirs(download_dir, exist_ok=True)
-
-    response = requests.get(download_url, stream=True)
-
-    # total size in bytes.
-    total_size = int(response.headers.get("content-length", 0))
-    block_size = 32 * 1024  # 32 Kibibytes
-
-    # create TQDM progress bar
-    prog_bar = progress_bar.tqdm(total=total_size, unit="iB", unit_scale=True)
-    try:
-        with open(full_filename, "wb") as fd:
-            for chunk in response.iter_content(block_size):
-                prog_bar.update(len(chunk))
-                fd.write(chunk)  # write video chunk to disk
-        prog_bar.close()
-
-        return True
-
-    except Exception as e:
-        print(
-            f"{Color.RED}### The video recording with filename '{filename}' "
-        )
-        # print(
-        #     f"{Color.RED}### The video recording with filename '{filename}' for user with email "
-        #     f"'{email}' could not be downloaded because {Color.END}'{e}'"
-        # )
-
-        return False
-
 def handle_graceful_shutdown(signal_received, frame):
     print(f"\n{Color.DARK_CYAN}SIGINT or CTRL-C detected. system.exiting gracefully.{Color.END}")
 
     system.exit(0)
 
 def get_by_meeting_id(meeting_id):
-    response = requests.get(
-        url=f"https://api.zoom.us/v2/meetings/{meeting_id}/recordings",
-        headers=AUTHORIZATION_HEADER
+    """ Get the recording of a meeting id, the downloads need its download urls """
+    return downloader.get_by_meeting_uuid(meeting_id)
+
+def track_of(directory_name, output_file_name):
+    """ Tell the pipeline which track a downloaded file is
+    :return: VIDEO_TRACK, the language of an interpretation track, or None
+    """
+    if directory_name == "." and output_file_name == mux.VIDEO_FILE_NAME:
+        return VIDEO_TRACK
+    if directory_name.startswith("audio-"):
+        return directory_name[len("audio-"):]
+    return None
+
+def video_title(recording, language):
+    """ The title of a mixed video, made from the zoom recording data """
+    return f"{recording.get('topic', 'Zoom recording')} {recording.get('start_time', '')[:10]} ({language})"
+
+def video_description(recording, language):
+    """ The description of a mixed video, made from the zoom recording data """
+    return (
+        f"{recording.get('topic', 'Zoom recording')}\n"
+        f"Recorded on {recording.get('start_time', '')} for {recording.get('duration', 0)} minutes.\n"
+        f"Language: {language}"
     )
-    recordings_data = response.json()
-    return recordings_data
-
-# Now assigning audio and video for mix is by rounding off duration.
-# But this is quite inaccurate. The best way is assigning by file name
-# TODO: 1. Define audio and video for mix
-#       2. Define output file name 
-# def mix_audio_and_video(audio_files, video_files):
-#     output_videos = []
-#     audio_file_list = dict()
-#     video_file_list = dict()
-#     for audio_file in audio_files:
-#         audio = AudioSegment.from_file(audio_file)
-#         duration_in_seconds = len(audio) / 1000.0
-#         duration_round_off = round(round(duration_in_seconds), -1)
-#         if duration_round_off in audio_file_list:
-#             audio_file_list[duration_round_off].append(audio_file)
-#         else:
-#             audio_file_list[duration_round_off] = [audio_file]
-#     for video_file in video_files:
-#         video_clip = VideoFileClip(video_file)
-#         duration = video_clip.duration
-#         video_clip.close()
-#         duration_round_off = round(round(duration), -1)
-#         if duration_round_off in video_file_list:
-#             video_file_list[duration_round_off].append(video_file)
-#         else:
-#             video_file_list[duration_round_off] = [video_file]
-#     for idx, duration in enumerate(audio_file_list):
-#         for audio_idx, audio_file in enumerate(audio_file_list[duration]):
-#             input_audio = ffmpeg.input(audio_file)
-#             for video_idx, video_file in enumerate(video_file_list[duration]):
-#                 input_video = ffmpeg.input(video_file)
-#                 output_video = video_file[:video_file.rfind('.')] + "-" + str(duration) + "-" + str(video_idx) + "-" + str(audio_idx) + ".mp4"
-#                 ffmpeg.concat(input_video, input_audio, v=1, a=1).output(output_video).run()
-#                 output_videos.append(output_video)
-#         # if idx == 1:
-#         #     break
-#     return output_videos
-
-# TODO: Define option information
-# def upload_videos_to_youtube(video_files):
-#     uploader = YoutubeUploader(YOUTUBE_CLIENT_ID, YOUTUBE_CLIENT_SECRET)
-#     uploader.authenticate(access_token=GOOGLE_OAUTH_ACCESS_TOKEN, refresh_token=GOOGLE_OAUTH_REFRESH_TOKEN)
-#     for idx, video_file in enumerate(video_files):
-#         # Video options
-#         options = {
-#             "title" : "TestVideo"+str(idx), # The video title
-# #            "description" : "Example description", # The video description
-# #            "tags" : ["tag1", "tag2", "tag3"],
-#             "categoryId" : YOUTUBE_CATEGORY,
-#             "privacyStatus" : "public", # Video privacy. Can either be "public", "private", or "unlisted"
-# #            "thumbnailLink" : "https://cdn.havecamerawilltravel.com/photographer/files/2020/01/youtube-logo-new-1068x510.jpg" # Optional. Specifies video thumbnail.
-#         }
-
-#         # upload video
-#         uploader.upload(video_file, options)
-#     uploader.close()
+
+def get_uploader(destination, recording):
+    """ The upload stage of the pipeline, a callable (language, video file) -> success """
+    if destination == "vimeo":
+        from uploader import vimeouploader
+        vimeo_uploader = vimeouploader()
+
+        def upload(language, video_file):
+            return vimeo_uploader.upload(video_file, video_title(recording, language)) is not None
+        return upload
+    if destination == "youtube":
+        from youtube_uploader import youtubeuploader
+        youtube_uploader = youtubeuploader()
+
+        def upload(language, video_file):
+            return youtube_uploader.upload(
+                video_file, video_title(recording, language), video_description(recording, language),
+                [recording.get("topic", "zoom"), language]
+            ) is not None
+        return upload
+    return None
 
 # ################################################################
 # #                        MAIN                                  #
 # ################################################################
 
-def main():
+def main(argv=None):
     # clear the screen buffer
     # os.system('cls' if os.name == 'nt' else 'clear')
 
-    load_access_token()
-
     parser = argparse.ArgumentParser(description='zoom video file downloader')
     parser.add_argument('--time', help='meeting video recoring time')
     parser.add_argument('--meetingid', help='zoom meeting id')
     parser.add_argument('--dir', help='Output file path')
-    args = parser.parse_args()
+    parser.add_argument('--upload', help='where to upload the mixed videos', choices=['none', 'vimeo', 'youtube'], default='none')
+    parser.add_argument('--s3', help='copy the downloads and mixed videos to the s3 bucket of the config file', action='store_true')
+    args = parser.parse_args(argv)
+    try:
+        load_access_token()
+    except ConfigError as e:
+        print(f"{Color.RED}### {e}{Color.END}")
+        system.exit(1)
     recording_time = args.time
     meeting_id = args.meetingid
     output_dir = args.dir
 
+    if not output_dir:
+        output_dir = DOWNLOAD_DIRECTORY
+    manifest = DownloadManifest(output_dir)
+
     recording = get_by_meeting_id(meeting_id)
+    if recording is None:
+        print(f"{Color.RED}### The recording of the meeting with id '{meeting_id}' couldn't be loaded.{Color.END}")
+        system.exit(1)
+    tasks = []
+    content_hashes = {}
+
+    # the downloads are checked and hashed by the downloader, and share its progress bar
+    progress = downloader.DownloadProgress()
+
+    def download(download_url, dl_dir, full_filename, file_size):
+        os.makedirs(dl_dir, exist_ok=True)
+        content_hashes[full_filename] = downloader.download_recording(download_url, full_filename, progress, file_size=file_size)
+        return content_hashes[full_filename] is not None
+
     try:
-        downloads = get_downloads(recording)
-        for recording_start, output_file_name, directory_name, download_url in downloads:
-            if output_dir == "":
-                output_dir = DOWNLOAD_DIRECTORY
+        downloads = get_downloads(recording, manifest)
+        for recording_start, output_file_name, directory_name, download_url, file_size in downloads:
             if recording_time == "":
                 recording_time = datetime.now()
             if datetime.strptime(recording_start, AUDIO_FILE_RECORDING_START_TIME_FORMAT) > datetime.fromisoformat(recording_time):
@@ -276,7 +221,11 @@ def main():
                     f"==> Downloading as {output_file_name}: "
                     f"{directory_name}: {truncated_url}"
                 )
-                download_recording(download_url, dl_dir, full_filename)
+                tasks.append((
+                    track_of(directory_name, output_file_name),
+                    full_filename,
+                    functools.partial(download, download_url, dl_dir, full_filename, file_size)
+                ))
             else:
                 print(f"{directory_name}"+"/"+f"{output_file_name}'s recording time {recording_start} is later than {recording_time}")
     except Exception:
@@ -284,64 +233,38 @@ def main():
               f"{Color.RED}### Recording files missing for call with id {Color.END}"
               f"'{recording['id']}'\n"
              )
-    
-    
-    # audio_files = []
-    # video_files = []
-    # for file_type, file_extension, download_url, recording_type, recording_id in downloads:
-    #     success = False
-    #     if recording_type != 'incomplete':
-    #         file_name, folder_name = (
-    #             format_filename({
-    #                 "file_type": file_type,
-    #                 "recording": recording,
-    #                 "file_extension": file_extension,
-    #                 "recording_type": recording_type,
-    #                 "recording_id": recording_id
-    #                 })
-    #             )
-    #         dl_dir = os.sep.join([DOWNLOAD_DIRECTORY, folder_name])
-    #         sanitized_download_dir = path_validate.sanitize_filepath(dl_dir)
-    #         sanitized_filename = path_validate.sanitize_filename(file_name)
-    #         full_filename = os.sep.join([sanitized_download_dir, sanitized_filename])
-    #         _, file_extension = os.path.splitext(file_name)
-    #         if file_extension == ".m4a":
-    #             audio_files.append(full_filename)
-    #         if file_extension == ".mp4":
-    #             video_files.append(full_filename)
-    #         # truncate URL to 64 characters
-    #         truncated_url = download_url[0:64] + "..."
-    #         print(
-    #             f"==> Downloading as {recording_type}: "
-    #             f"{recording_id}: {truncated_url}"
-    #         )
-    #         success |= download_recording(download_url, file_name, sanitized_download_dir, full_filename)
-
-    #     else:
-    #         print(
-    #             f"{Color.RED}### Incomplete Recording for "
-    #             f"recording with id {Color.END}'{recording_id}'"
-    #         )
-    #         success = False
-    # try:
-    #     mixed_video_files = mix_audio_and_video(audio_files, video_files)
-    # except Exception as error:
-    #     print(
-    #           f"{Color.RED}### Mixing audio and video files has failed. {Color.END}", error
-    #          )
-    # try:
-    #     upload_videos_to_youtube(mixed_video_files)
-    # except Exception as error:
-    #     print(
-    #           f"{Color.RED}### Uploading video files has failed. {Color.END}", error
-    #          )
-
-    # print(f"\n{Color.BOLD}{Color.GREEN}*** All done! ***{Color.END}")
-    # save_location = os.path.abspath(DOWNLOAD_DIRECTORY)
-    # print(
-    #     f"\n{Color.BLUE}Recordings have been saved to: {Color.UNDERLINE}{save_location}"
-    #     f"{Color.END}\n"
-    # )
+
+    # download, mix and upload as a pipeline: every language is mixed as soon as
+    # its audio and the video are downloaded, and uploaded as soon as it is mixed
+    try:
+        upload = get_uploader(args.upload, recording)
+    except ConfigError as e:
+        print(f"{Color.RED}### {e}{Color.END}")
+        system.exit(1)
+    try:
+        results = Pipeline(output_dir, upload=upload).run(tasks)
+    finally:
+        progress.close()
+    for full_filename, success in results["downloads"].items():
+        if success:
+            manifest.mark_done(os.path.relpath(full_filename, output_dir), content_hashes.get(full_filename))
+    manifest.save()
+    if args.s3:
+        import s3_uploader
+        # every meeting directory gets its own prefix in the bucket
+        try:
+            s3_config = s3_uploader.s3_config()
+        except ConfigError as e:
+            print(f"{Color.RED}### {e}{Color.END}")
+            system.exit(1)
+        prefix = "/".join(filter(None, [s3_config.get("prefix", "").strip("/"), os.path.basename(os.path.abspath(output_dir))]))
+        results["s3"] = s3_uploader.upload_directory(output_dir, prefix, s3_config)
+    failed = [name for stage in results.values() for name, success in stage.items() if not success]
+    if failed:
+        print(f"{Color.RED}### {len(failed)} pipeline steps failed: {', '.join(sorted(failed))}{Color.END}")
+        system.exit(1)
+    else:
+        print(f"\n{Color.BOLD}{Color.GREEN}*** All done! ***{Color.END}")
 
 if __name__ == "__main__":
     # tell Python to shutdown gracefully when SIGINT is received
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+
+from file_lock import locked
+
+MANIFEST_FILE_NAME = ".recordings-manifest.json"
+
+
+class DownloadManifest:
+    """ Keeps track of the recording files already downloaded into an output directory.
+    Each entry is keyed by the Zoom recording file id and holds its file_size,
+    recording_start and the path of the file relative to the output directory.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.entries = {}
+        self.pending = {}
+        try:
+            with open(self.path, encoding="utf-8") as manifest_file:
+                self.entries = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring unreadable manifest {self.path}")
+
+    def local_size(self, relative_path):
+        full_filename = os.path.join(self.output_dir, relative_path)
+        if not os.path.isfile(full_filename):
+            return None
+        return os.path.getsize(full_filename)
+
+    def is_current(self, recording_file, relative_path):
+        """ Check if a recording file is already downloaded and unchanged
+        :param recording_file: the recording file data from the Zoom API
+        :param relative_path: the path of the file relative to the output directory
+        :return: True if the file doesn't need to be downloaded again
+        """
+        file_size = recording_file.get("file_size")
+        if file_size is None or self.local_size(relative_path) != file_size:
+            return False
+        entry = self.entries.get(recording_file["id"])
+        if entry is None:
+            # downloaded before the manifest existed, adopt it
+            self.entries[recording_file["id"]] = self.make_entry(recording_file, relative_path)
+            return True
+        return (
+            entry["file_size"] == file_size
+            and entry["recording_start"] == recording_file.get("recording_start")
+            and entry["path"] == relative_path
+        )
+
+    @staticmethod
+    def make_entry(recording_file, relative_path):
+        return {
+            "id": recording_file["id"],
+            "file_size": recording_file.get("file_size"),
+            "recording_start": recording_file.get("recording_start"),
+            "path": relative_path,
+        }
+
+    def track(self, recording_file, relative_path):
+        """ Remember a recording file that is about to be downloaded """
+        self.pending[relative_path] = self.make_entry(recording_file, relative_path)
+
+    def mark_done(self, relative_path, content_hash=None):
+        """ Move a tracked recording file into the manifest once it is downloaded
+        :param content_hash: the content hash of the verified download, see content_hash
+        """
+        entry = self.pending.pop(relative_path, None)
+        if entry is not None:
+            if content_hash is not None:
+                entry["content_hash"] = content_hash
+            self.entries[entry["id"]] = entry
+        return entry
+
+    def save_done(self, relative_path, content_hash=None):
+        """ Move a tracked recording file into the manifest and onto disk right away,
+        keeping what other processes saved into the same manifest in the meantime
+        """
+        entry = self.mark_done(relative_path, content_hash)
+        if entry is None:
+            return
+        with locked(self.path):
+            latest = DownloadManifest(self.output_dir)
+            latest.entries[entry["id"]] = entry
+            latest.save()
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(self.entries, manifest_file, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
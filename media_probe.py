@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import threading
+
+import ffmpeg
+
+MEDIA_INDEX_FILE_NAME = ".media-index.json"
+
+
+def summarize(probe_result):
+    """ Reduce the ffprobe output to what the pipeline needs
+    :return: a dict with duration, format, codecs and the number of video and audio streams
+    """
+    streams = probe_result.get("streams", [])
+    video_streams = [stream for stream in streams if stream.get("codec_type") == "video"]
+    audio_streams = [stream for stream in streams if stream.get("codec_type") == "audio"]
+    return {
+        "duration": float(probe_result.get("format", {}).get("duration", 0.0)),
+        "format": probe_result.get("format", {}).get("format_name"),
+        "video_codecs": [stream.get("codec_name") for stream in video_streams],
+        "audio_codecs": [stream.get("codec_name") for stream in audio_streams],
+        "video_streams": len(video_streams),
+        "audio_streams": len(audio_streams),
+        "audio_sample_rate": int(audio_streams[0]["sample_rate"]) if audio_streams and "sample_rate" in audio_streams[0] else None,
+    }
+
+
+class MediaIndex:
+    """ Probe results of the media files of one directory, stored in .media-index.json.
+    ffprobe only reads the container headers, and an entry is reused for as long as
+    the size and mtime of its file don't change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MEDIA_INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, encoding="utf-8") as index_file:
+                self.entries = json.load(index_file)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring unreadable media index {self.path}")
+
+    def probe(self, file_path):
+        """ Get the duration, codecs and stream counts of a media file
+        :param file_path: a file in the directory of the index
+        :return: the summary of the ffprobe output
+        :raise ffmpeg.Error: if the file couldn't be probed
+        """
+        stat = os.stat(file_path)
+        key = os.path.basename(file_path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["media"]
+        media = summarize(ffmpeg.probe(file_path))
+        with self.lock:
+            self.entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "media": media}
+            self.dirty = True
+        return media
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as index_file:
+                json.dump(self.entries, index_file, indent=2)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+def probe(file_path):
+    """ Probe a single file through the index of its directory """
+    index = MediaIndex(os.path.dirname(file_path) or ".")
+    media = index.probe(file_path)
+    index.save()
+    return media
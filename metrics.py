@@ -0,0 +1,164 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# every finished span is appended to the file named by $METRICS_JSONL as one json line,
+# the totals are kept in the Prometheus textfile named by $METRICS_TEXTFILE
+METRICS_JSONL_ENV = "METRICS_JSONL"
+METRICS_TEXTFILE_ENV = "METRICS_TEXTFILE"
+METRIC_PREFIX = "zoom_pipeline"
+
+
+class Span:
+    """ The timing of one run of a stage, with the bytes it moved and its time to first byte """
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.duration = None
+        self.bytes = 0
+        self.ttfb = None
+        self.status = "ok"
+
+    def add_bytes(self, size):
+        self.bytes += size
+
+    def first_byte(self):
+        """ Mark the arrival of the first byte of a response, only the first call counts """
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.start
+
+    def fail(self):
+        self.status = "error"
+
+    def to_json(self):
+        return {
+            "ts": self.started_at,
+            "stage": self.stage,
+            "status": self.status,
+            "duration": round(self.duration, 6),
+            "bytes": self.bytes,
+            "bytes_per_second": round(self.bytes / self.duration, 1) if self.bytes and self.duration else None,
+            "ttfb": round(self.ttfb, 6) if self.ttfb is not None else None,
+            **self.labels,
+        }
+
+
+class Metrics:
+    """ Thread safe totals of every stage of the process and of the counters like retries """
+
+    def __init__(self, jsonl_path=None, textfile_path=None):
+        self.jsonl_path = jsonl_path
+        self.textfile_path = textfile_path
+        # labels added to every sample of the textfile, see per_process
+        self.labels = ()
+        self.lock = threading.Lock()
+        # (stage, status) -> [runs, seconds, bytes]
+        self.stages = {}
+        # stage -> [responses, seconds to first byte]
+        self.ttfb = {}
+        # (name, sorted label items) -> value
+        self.counters = {}
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """ Time a stage, the span is marked as failed if the block raises """
+        span = Span(stage, labels)
+        try:
+            yield span
+        except BaseException:
+            span.fail()
+            raise
+        finally:
+            span.duration = time.monotonic() - span.start
+            self.record(span)
+
+    def record(self, span):
+        with self.lock:
+            totals = self.stages.setdefault((span.stage, span.status), [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += span.duration
+            totals[2] += span.bytes
+            if span.ttfb is not None:
+                ttfb = self.ttfb.setdefault(span.stage, [0, 0.0])
+                ttfb[0] += 1
+                ttfb[1] += span.ttfb
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as jsonl_file:
+                    jsonl_file.write(json.dumps(span.to_json()) + "\n")
+        if self.textfile_path:
+            self.write_textfile()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def textfile(self):
+        """ The totals in the Prometheus text exposition format """
+        with self.lock:
+            stages = sorted(self.stages.items())
+            ttfb = sorted(self.ttfb.items())
+            counters = sorted(self.counters.items())
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{str(label).replace(chr(34), chr(39))}"' for key, label in self.labels + labels)
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+        stage_labels = [((("stage", stage), ("status", status)), totals) for (stage, status), totals in stages]
+        metric("stage_runs_total", "counter", [(labels, totals[0]) for labels, totals in stage_labels])
+        metric("stage_seconds_total", "counter", [(labels, round(totals[1], 6)) for labels, totals in stage_labels])
+        metric("stage_bytes_total", "counter", [(labels, totals[2]) for labels, totals in stage_labels])
+        metric("stage_ttfb_seconds_sum", "counter", [((("stage", stage),), round(total[1], 6)) for stage, total in ttfb])
+        metric("stage_ttfb_seconds_count", "counter", [((("stage", stage),), total[0]) for stage, total in ttfb])
+        for name in sorted({counter for (counter, _), _ in counters}):
+            metric(f"{name}_total", "counter", [(labels, value) for (counter, labels), value in counters if counter == name])
+        metric("last_update_seconds", "gauge", [((), f"{time.time():.0f}")])
+        return "\n".join(lines) + "\n"
+
+    def per_process(self, name):
+        """ Keep the totals of this process in a textfile of its own, e.g. for the workers of a runner
+        that all inherit the same $METRICS_TEXTFILE and would otherwise replace each other's file
+        :param name: tells the processes apart, it is added to the file name and as a worker label to every sample
+        """
+        self.labels = (("worker", name),)
+        if self.textfile_path:
+            root, extension = os.path.splitext(self.textfile_path)
+            self.textfile_path = f"{root}.{name}{extension}"
+
+    def write_textfile(self, path=None):
+        """ Write the totals so that node_exporter's textfile collector never sees a partial file """
+        path = path or self.textfile_path
+        if not path:
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as textfile:
+            textfile.write(self.textfile())
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics(os.environ.get(METRICS_JSONL_ENV), os.environ.get(METRICS_TEXTFILE_ENV))
+# counters may change after the last span, the textfile is written once more on exit
+atexit.register(METRICS.write_textfile)
+
+
+def span(stage, **labels):
+    """ Time a stage of the process
+    :param stage: the stage name, e.g. download or mux
+    :param labels: details of this run written to the json lines only, e.g. the file name
+    :return: a context manager yielding the Span
+    """
+    return METRICS.span(stage, **labels)
+
+
+def count(name, value=1, **labels):
+    """ Add to a counter, e.g. count("retries", stage="download") """
+    METRICS.count(name, value, **labels)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ffmpeg
+
+import metrics
+from align import align_tracks, cached_reference, trusted_offsets
+from media_probe import MediaIndex
+
+VIDEO_FILE_NAME = "source-video.mp4"
+OUTPUT_FILE_NAME = "video-{}.mp4"
+# downloader.py writes audio-<lang>.m4a, main.py writes audio-<lang>/source-audio.m4a
+AUDIO_FILE_PATTERN = re.compile(r"^audio-([a-z]{2,3})\.(m4a|mp4|aac)$")
+AUDIO_DIRECTORY_PATTERN = re.compile(r"^audio-([a-z]{2,3})$")
+AUDIO_DIRECTORY_FILE_NAME = "source-audio.m4a"
+# warn when an audio track and the video differ in length by more than this, in seconds
+DURATION_MISMATCH_WARNING = 60
+
+
+def find_language_tracks(download_dir):
+    """ Find the interpretation audio tracks of a meeting
+    :param download_dir: the directory the recordings were downloaded to
+    :return: a dict of language -> audio file
+    """
+    tracks = {}
+    for entry in sorted(os.listdir(download_dir)):
+        path = os.path.join(download_dir, entry)
+        file_match = AUDIO_FILE_PATTERN.match(entry)
+        directory_match = AUDIO_DIRECTORY_PATTERN.match(entry)
+        if file_match and os.path.isfile(path):
+            tracks[file_match.group(1)] = path
+        elif directory_match and os.path.isfile(os.path.join(path, AUDIO_DIRECTORY_FILE_NAME)):
+            tracks[directory_match.group(1)] = os.path.join(path, AUDIO_DIRECTORY_FILE_NAME)
+    return tracks
+
+
+def mux_language(video_file, audio_file, output_file, audio_offset=0.0):
+    """ Put an audio track onto the video without re-encoding either of them
+    :param video_file: the shared_screen_with_speaker_view video
+    :param audio_file: the audio track of one language
+    :param output_file: the muxed video
+    :param audio_offset: seconds the audio starts after the video, negative if it starts before
+    :return: the output file
+    """
+    input_video = ffmpeg.input(video_file)
+    input_audio = ffmpeg.input(audio_file, itsoffset=audio_offset) if audio_offset else ffmpeg.input(audio_file)
+    tmp_file = output_file + ".tmp.mp4"
+    (
+        ffmpeg
+        .output(input_video.video, input_audio.audio, tmp_file, c="copy", movflags="+faststart")
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def check_tracks(video_file, audio_files, results):
+    """ Probe the video and the audio tracks from their headers before muxing them
+    Tracks without an audio stream are left out and marked as failed in results.
+    :return: a dict of language -> audio file of the tracks that can be muxed
+    """
+    index = MediaIndex(os.path.dirname(video_file) or ".")
+    video = index.probe(video_file)
+    if not video["video_streams"]:
+        raise ValueError(f"{video_file} has no video stream")
+    usable = {}
+    for language, audio_file in audio_files.items():
+        audio_index = index if os.path.dirname(audio_file) == os.path.dirname(video_file) else MediaIndex(os.path.dirname(audio_file))
+        try:
+            audio = audio_index.probe(audio_file)
+        except ffmpeg.Error as e:
+            logging.error(f"### Probing {audio_file} failed: {e}")
+            results[language] = None
+            continue
+        finally:
+            audio_index.save()
+        if not audio["audio_streams"]:
+            logging.error(f"### {audio_file} has no audio stream")
+            results[language] = None
+            continue
+        if abs(audio["duration"] - video["duration"]) > DURATION_MISMATCH_WARNING:
+            logging.warning(f"{audio_file} lasts {audio['duration']:.0f}s, the video {video['duration']:.0f}s")
+        usable[language] = audio_file
+    index.save()
+    return usable
+
+
+def is_up_to_date(output_file, *input_files):
+    """ Tell if a muxed video was written after every file it is made of """
+    try:
+        output_mtime = os.stat(output_file).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return all(os.stat(input_file).st_mtime_ns < output_mtime for input_file in input_files)
+
+
+def mux_track(video_file, language, audio_file, output_dir, align=True):
+    """ Check, align and mux a single language track, e.g. as soon as it is downloaded
+    A muxed video newer than both the video and the track is kept as it is.
+    :param language: the language of the track, the muxed video is named after it
+    :param output_dir: the directory of the muxed video
+    :param align: align the track against the video's own audio before muxing it
+    :return: the muxed video, or None if the track has no audio stream
+    """
+    output_file = os.path.join(output_dir, OUTPUT_FILE_NAME.format(language))
+    if is_up_to_date(output_file, video_file, audio_file):
+        logging.info(f"{output_file} is up to date. Skipping.")
+        return output_file
+    if not check_tracks(video_file, {language: audio_file}, {}):
+        return None
+    audio_offset = 0.0
+    if align:
+        with metrics.span("align", language=language):
+            audio_offset = cached_reference(video_file).offset(language, audio_file)
+    return mux_language(video_file, audio_file, output_file, audio_offset)
+
+
+def mux_all(video_file, audio_files, output_dir, jobs=None, audio_offsets=None):
+    """ Mux the video with every language track in a process pool
+    :param video_file: the shared_screen_with_speaker_view video
+    :param audio_files: a dict of language -> audio file
+    :param output_dir: the directory of the muxed videos
+    :param jobs: the number of muxes running at once, the number of cores by default
+    :param audio_offsets: an optional dict of language -> audio offset in seconds
+    :return: a dict of language -> muxed video, or None if the mux failed
+    """
+    audio_offsets = audio_offsets or {}
+    results = {}
+    audio_files = check_tracks(video_file, audio_files, results)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {
+            executor.submit(
+                mux_language, video_file, audio_file,
+                os.path.join(output_dir, OUTPUT_FILE_NAME.format(language)),
+                audio_offsets.get(language, 0.0)
+            ): language
+            for language, audio_file in audio_files.items()
+        }
+        for future in as_completed(futures):
+            language = futures[future]
+            try:
+                results[language] = future.result()
+                logging.info(f"==> Muxed {language}: {results[language]}")
+            except ffmpeg.Error as e:
+                logging.error(f"### Muxing {language} failed: {e.stderr.decode('utf-8', 'replace') if e.stderr else e}")
+                results[language] = None
+    return results
+
+
+def mux_meeting(download_dir, jobs=None, align=True):
+    """ Mux every language track of a meeting onto its video
+    :param download_dir: the directory the recordings were downloaded to, the muxed videos are written there too
+    :param jobs: the number of muxes running at once, the number of cores by default
+    :param align: align each track against the video's own audio before muxing
+    :return: a dict of language -> muxed video, or None if the mux failed
+    """
+    video_file = os.path.join(download_dir, VIDEO_FILE_NAME)
+    audio_files = find_language_tracks(download_dir)
+    audio_offsets = {}
+    if align and audio_files:
+        with metrics.span("align", directory=download_dir):
+            audio_offsets = trusted_offsets(align_tracks(video_file, audio_files, jobs))
+    with metrics.span("mux", directory=download_dir) as span:
+        results = mux_all(video_file, audio_files, download_dir, jobs, audio_offsets)
+        span.add_bytes(sum(os.path.getsize(output_file) for output_file in results.values() if output_file))
+        if None in results.values():
+            span.fail()
+    return results
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='mux zoom interpretation audio onto the video')
+    parser.add_argument('--dir', help='directory of the downloaded recordings', required=True)
+    parser.add_argument('--jobs', help='number of concurrent muxes', default=None, type=int)
+    parser.add_argument('--no-align', help='mux the tracks without aligning them to the video', action='store_true')
+    args = parser.parse_args(argv)
+    results = mux_meeting(args.dir, args.jobs, not args.no_align)
+    if not results or None in results.values():
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
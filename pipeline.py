@@ -0,0 +1,143 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+import metrics
+import mux
+
+VIDEO_TRACK = "video"
+DEFAULT_DOWNLOAD_JOBS = 4
+DEFAULT_UPLOAD_JOBS = 2
+
+
+class Pipeline:
+    """ Downloads, muxes and uploads a meeting as a producer/consumer pipeline.
+    A language is muxed as soon as the video and its audio track are both on disk,
+    and every muxed video is handed to the upload stage as soon as it is written.
+    The stages are connected by bounded queues so a slow stage holds back the one
+    feeding it instead of piling up work.
+    """
+
+    def __init__(self, download_dir, upload=None, download_jobs=DEFAULT_DOWNLOAD_JOBS,
+                 mux_jobs=None, upload_jobs=DEFAULT_UPLOAD_JOBS, align=True):
+        """
+        :param download_dir: the directory of the downloads and the muxed videos
+        :param upload: an optional callable (language, video file) -> True if the upload succeeded
+        :param download_jobs: the number of concurrent downloads
+        :param mux_jobs: the number of concurrent muxes, the number of cores by default
+        :param upload_jobs: the number of concurrent uploads
+        :param align: align each track against the video's own audio before muxing it
+        """
+        self.download_dir = download_dir
+        self.upload = upload
+        self.download_jobs = download_jobs
+        self.mux_jobs = mux_jobs or os.cpu_count()
+        self.upload_jobs = upload_jobs
+        self.align = align
+        self.mux_queue = queue.Queue(maxsize=self.mux_jobs * 2)
+        self.upload_queue = queue.Queue(maxsize=self.upload_jobs * 2)
+        self.results = {"downloads": {}, "muxes": {}, "uploads": {}}
+
+    def video_file(self):
+        return os.path.join(self.download_dir, mux.VIDEO_FILE_NAME)
+
+    def mux_worker(self):
+        while True:
+            item = self.mux_queue.get()
+            if item is None:
+                return
+            language, audio_file = item
+            with metrics.span("mux", language=language) as span:
+                try:
+                    output_file = mux.mux_track(self.video_file(), language, audio_file, self.download_dir, self.align)
+                except ffmpeg.Error as e:
+                    logging.error(f"### Muxing {language} failed: {e.stderr.decode('utf-8', 'replace') if e.stderr else e}")
+                    self.results["muxes"][language] = None
+                    span.fail()
+                    continue
+                except Exception as e:
+                    logging.error(f"### Muxing {language} failed: {e}")
+                    self.results["muxes"][language] = None
+                    span.fail()
+                    continue
+                if output_file is None:
+                    self.results["muxes"][language] = None
+                    span.fail()
+                    continue
+                span.add_bytes(os.path.getsize(output_file))
+            logging.info(f"==> Muxed {language}: {output_file}")
+            self.results["muxes"][language] = output_file
+            if self.upload is not None:
+                self.upload_queue.put((language, output_file))
+
+    def upload_worker(self):
+        while True:
+            item = self.upload_queue.get()
+            if item is None:
+                return
+            language, video_file = item
+            try:
+                self.results["uploads"][language] = bool(self.upload(language, video_file))
+            except Exception as e:
+                logging.error(f"### Uploading {video_file} failed: {e}")
+                self.results["uploads"][language] = False
+
+    def run(self, downloads):
+        """ Run the pipeline
+        :param downloads: a list of tuples (track, full_filename, download) where track is VIDEO_TRACK,
+            a language or None for files that aren't muxed, and download a callable returning True on success
+        :return: a dict with the downloads, muxes and uploads results
+        """
+        scheduled = {os.path.normpath(full_filename) for _, full_filename, _ in downloads}
+        # files already on disk and not downloaded again are ready right away
+        video_ready = os.path.isfile(self.video_file()) and os.path.normpath(self.video_file()) not in scheduled
+        audio_ready = {
+            language: audio_file
+            for language, audio_file in mux.find_language_tracks(self.download_dir).items()
+            if os.path.normpath(audio_file) not in scheduled
+        } if os.path.isdir(self.download_dir) else {}
+
+        mux_threads = [threading.Thread(target=self.mux_worker) for _ in range(self.mux_jobs)]
+        upload_threads = [threading.Thread(target=self.upload_worker) for _ in range(self.upload_jobs)]
+        for thread in mux_threads + upload_threads:
+            thread.start()
+
+        completed = queue.Queue()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.download_jobs)) as executor:
+                for track, full_filename, download in downloads:
+                    future = executor.submit(download)
+                    future.add_done_callback(
+                        lambda future, track=track, full_filename=full_filename: completed.put((track, full_filename, future))
+                    )
+                if video_ready:
+                    for language, audio_file in audio_ready.items():
+                        self.mux_queue.put((language, audio_file))
+                for _ in downloads:
+                    track, full_filename, future = completed.get()
+                    success = future.exception() is None and bool(future.result())
+                    self.results["downloads"][full_filename] = success
+                    if not success or track is None:
+                        continue
+                    if track == VIDEO_TRACK:
+                        video_ready = True
+                        for language, audio_file in audio_ready.items():
+                            self.mux_queue.put((language, audio_file))
+                    else:
+                        audio_ready[track] = full_filename
+                        if video_ready:
+                            self.mux_queue.put((track, full_filename))
+        finally:
+            for _ in mux_threads:
+                self.mux_queue.put(None)
+            for thread in mux_threads:
+                thread.join()
+            for _ in upload_threads:
+                self.upload_queue.put(None)
+            for thread in upload_threads:
+                thread.join()
+        return self.results
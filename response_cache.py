@@ -0,0 +1,148 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import metrics
+from token_cache import TOKEN_CACHE_DIR
+
+RESPONSE_CACHE_DIR = os.path.join(TOKEN_CACHE_DIR, "responses")
+# recording metadata is reused for this many seconds before the API is asked again
+RESPONSE_CACHE_TTL = 10 * 60
+# the least recently used responses are evicted once the directory grows beyond this
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# and a process keeps at most this many responses in memory
+RESPONSE_CACHE_MAX_ENTRIES = 256
+# never written to disk, a download url is enough to fetch a recording with any valid token
+SECRET_KEYS = (
+    "download_url", "play_url", "share_url", "password", "encrypted_password",
+    "recording_play_passcode", "access_token", "download_access_token",
+)
+SECRET_PARAMETER = re.compile(r"((?:access_token|pwd)=)[^&\"\s]*")
+
+
+def cache_key(scope, url, params=None):
+    """ Identify a response by the account it belongs to, the endpoint and the query parameters """
+    query = urlencode(sorted((key, str(value)) for key, value in (params or {}).items()))
+    return f"{scope} {url}?{query}"
+
+
+def strip_secrets(body):
+    """ A copy of a response body without download urls, passcodes and tokens """
+    if isinstance(body, dict):
+        return {key: strip_secrets(value) for key, value in body.items() if key not in SECRET_KEYS}
+    if isinstance(body, list):
+        return [strip_secrets(value) for value in body]
+    if isinstance(body, str):
+        return SECRET_PARAMETER.sub(r"\1", body)
+    return body
+
+
+class ResponseCache:
+    """ Keeps API responses for a while, in memory as they are and on disk without their secrets.
+    A response with its download urls is only ever found again by the process that fetched it,
+    other processes get the stripped copy, which is enough to look up uuids, times and topics.
+    """
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> (expires_at, body with its secrets), the least recently used first
+        self.memory = OrderedDict()
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"response-{digest}.json")
+
+    def get(self, key, with_secrets=False):
+        """ Get a response that hasn't expired yet
+        :param key: see cache_key
+        :param with_secrets: the caller needs the download urls, only a response of this process will do
+        :return: a copy of the response body, or None
+        """
+        now = time.time()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None and cached[0] <= now:
+                del self.memory[key]
+                cached = None
+            elif cached is not None:
+                self.memory.move_to_end(key)
+        if cached is not None:
+            metrics.count("response_cache_lookups", result="memory")
+            return copy.deepcopy(cached[1])
+        if with_secrets:
+            metrics.count("response_cache_lookups", result="miss")
+            return None
+
+        path = self.path(key)
+        try:
+            with open(path, encoding="utf-8") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, json.JSONDecodeError):
+            cached = None
+        if cached is None or cached.get("key") != key or cached.get("expires_at", 0) <= now:
+            metrics.count("response_cache_lookups", result="miss")
+            return None
+        try:
+            # the modification time orders the entries for the eviction
+            os.utime(path)
+        except OSError:
+            pass
+        metrics.count("response_cache_lookups", result="disk")
+        return cached["body"]
+
+    def put(self, key, body):
+        """ Keep a response body, a failed write only costs a request later on """
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.memory[key] = (expires_at, copy.deepcopy(body))
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                json.dump({"key": key, "expires_at": expires_at, "body": strip_secrets(body)}, cache_file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Unable to cache the response in {path}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used responses until the directory fits into max_bytes """
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.startswith("response-") and entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+RESPONSE_CACHE = ResponseCache()
@@ -0,0 +1,74 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# an upload session expires after a while, the server then answers with one of these and it is started over
+EXPIRED_STATUS_CODES = (404, 410)
+
+
+class UploadSessionExpired(Exception):
+    pass
+
+
+class ResumableUploader:
+    """ What the vimeo and youtube uploaders share: the state of an upload is kept next to its file,
+    so that the next run continues where an interrupted one stopped, and once the upload is complete
+    it keeps the uploaded video so that the next run doesn't upload the same file again.
+    A subclass sets state_suffix and default_jobs and implements upload(file_name, name, description).
+    """
+
+    state_suffix = '.upload.json'
+    default_jobs = 1
+
+    def state_file(self, file_name):
+        return file_name + self.state_suffix
+
+    def load_state(self, file_name):
+        """ Load the saved upload of a file if the file didn't change since """
+        try:
+            with open(self.state_file(file_name)) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        stat = os.stat(file_name)
+        if state.get('size') != stat.st_size or state.get('mtime_ns') != stat.st_mtime_ns:
+            return None
+        return state
+
+    def save_state(self, file_name, state):
+        tmp_name = self.state_file(file_name) + '.tmp'
+        with open(tmp_name, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_name, self.state_file(file_name))
+
+    def mark_uploaded(self, file_name, state, video):
+        """ Keep the state of a finished upload with the uri or id of its video """
+        state['uploaded'] = video
+        self.save_state(file_name, state)
+
+    def uploaded(self, file_name):
+        """ The uri or id of the video a file was already uploaded as, None if it wasn't or changed since """
+        state = self.load_state(file_name)
+        return state.get('uploaded') if state is not None else None
+
+    def remove_state(self, file_name):
+        try:
+            os.remove(self.state_file(file_name))
+        except FileNotFoundError:
+            pass
+
+    def upload(self, file_name, name=None, description=None):
+        raise NotImplementedError
+
+    def upload_all(self, uploads, jobs=None):
+        """ Upload several files in parallel
+        :param uploads: a list of tuples (file_name, name, description)
+        :param jobs: the number of files uploading at once, default_jobs if not given
+        :return: a dict of file_name -> the result of upload, None if the upload failed
+        """
+        with ThreadPoolExecutor(max_workers=max(1, jobs or self.default_jobs)) as executor:
+            futures = {
+                executor.submit(self.upload, file_name, name, description): file_name
+                for file_name, name, description in uploads
+            }
+            return {futures[future]: future.result() for future in as_completed(futures)}
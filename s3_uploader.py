@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import logging
+import os
+
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import BotoCoreError, ClientError
+
+import metrics
+from config import ConfigError, config_path, load_config
+
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+DEFAULT_UPLOAD_JOBS = 8
+# S3 needs at least 5 MiB per part except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+# partial downloads, sidecar state and indexes that are not worth keeping
+SKIPPED_SUFFIXES = (".part", ".lock", ".tmp", ".tmp.mp4", ".vimeo-upload.json", ".youtube-upload.json")
+
+
+def get_client(config):
+    """ An S3 client for the configured endpoint, endpoint_url points it at MinIO or another stand-in """
+    return boto3.client(
+        "s3",
+        endpoint_url=config.get("endpoint_url"),
+        region_name=config.get("region"),
+        aws_access_key_id=config.get("access_key_id"),
+        aws_secret_access_key=config.get("secret_access_key"),
+    )
+
+
+def file_etag(file_path, part_size, multipart=True):
+    """ The ETag S3 gives a file uploaded in parts of part_size, computed in one streaming pass
+    :param multipart: whether the file was sent as a multipart upload or in a single request
+    :return: the md5 of the part md5s followed by -<parts>, or the md5 of the file for a single request
+    """
+    part_digests = []
+    with open(file_path, "rb") as file:
+        while True:
+            part = hashlib.md5()
+            remaining = part_size
+            while remaining:
+                block = file.read(min(HASH_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                part.update(block)
+                remaining -= len(block)
+            if remaining == part_size and part_digests:
+                break
+            part_digests.append(part.digest())
+            if remaining:
+                break
+    if not multipart:
+        return part_digests[0].hex()
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def is_unchanged(client, bucket, key, file_path, part_size):
+    """ Tell if an object already holds the file, by size first and by ETag when the sizes match """
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    if head["ContentLength"] != os.path.getsize(file_path):
+        return False
+    remote_etag = head["ETag"].strip('"')
+    multipart = "-" in remote_etag
+    if multipart:
+        # the object may have been uploaded with another part size, its first part tells which
+        part_size = client.head_object(Bucket=bucket, Key=key, PartNumber=1)["ContentLength"]
+    else:
+        part_size = max(head["ContentLength"], 1)
+    return file_etag(file_path, part_size, multipart) == remote_etag
+
+
+def find_files(directory):
+    """ The files of a directory worth uploading, hidden files and partial downloads are left out
+    :return: a list of paths relative to the directory
+    """
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(names):
+            if name.startswith(".") or name.endswith(SKIPPED_SUFFIXES):
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), directory))
+    return files
+
+
+def upload_files(client, bucket, uploads, part_size=DEFAULT_PART_SIZE, jobs=DEFAULT_UPLOAD_JOBS):
+    """ Upload files in parallel multipart uploads, skipping the ones already in the bucket
+    Every part is read from disk when it is sent, at most jobs parts are in flight across all files.
+    :param uploads: a list of tuples (file path, key)
+    :param part_size: the size of a multipart part, files smaller than that are sent in one request
+    :param jobs: the number of parts uploading at once
+    :return: a dict of key -> True if the object is up to date
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    results = {}
+    pending = {}
+    transfer_config = TransferConfig(
+        multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=jobs, use_threads=True
+    )
+    with metrics.span("upload_s3", bucket=bucket) as span, create_transfer_manager(client, transfer_config) as manager:
+        for file_path, key in uploads:
+            try:
+                if is_unchanged(client, bucket, key, file_path, part_size):
+                    logging.info(f"{key} is unchanged. Skipping.")
+                    results[key] = True
+                    continue
+            except (BotoCoreError, ClientError, OSError) as e:
+                logging.error(f"### Checking {key} failed: {e}")
+                results[key] = False
+                continue
+            logging.info(f"==> Uploading {file_path} to s3://{bucket}/{key}")
+            pending[key] = manager.upload(file_path, bucket, key)
+        for key, future in pending.items():
+            try:
+                future.result()
+                span.add_bytes(future.meta.size or 0)
+                results[key] = True
+            except (BotoCoreError, ClientError, OSError) as e:
+                logging.error(f"### Uploading {key} failed: {e}")
+                results[key] = False
+                span.fail()
+    return results
+
+
+def s3_config():
+    """ The s3 section of the config file
+    :raise ConfigError: if the file or its bucket is missing
+    """
+    config = load_config().get("s3")
+    if not config or "bucket" not in config:
+        raise ConfigError(f"We could not locate your s3 bucket in `{config_path()}`.")
+    return config
+
+
+def upload_directory(directory, prefix="", config=None):
+    """ Upload the downloads and muxed videos of a meeting
+    :param directory: the meeting directory, its layout is kept under the prefix
+    :param prefix: the key prefix, the prefix of the config file by default
+    :param config: the s3 section of the config file, read from downloader.conf if not given
+    :return: a dict of key -> True if the object is up to date
+    """
+    config = config if config is not None else s3_config()
+    prefix = prefix or config.get("prefix", "")
+    uploads = [
+        (os.path.join(directory, relative_path), "/".join(filter(None, [prefix.strip("/"), relative_path.replace(os.sep, "/")])))
+        for relative_path in find_files(directory)
+    ]
+    return upload_files(
+        get_client(config), config["bucket"], uploads,
+        config.get("part_size", DEFAULT_PART_SIZE), config.get("jobs", DEFAULT_UPLOAD_JOBS)
+    )
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='upload zoom recordings and muxed videos to s3')
+    parser.add_argument('--dir', help='directory of the downloaded recordings', required=True)
+    parser.add_argument('--prefix', help='key prefix in the bucket', default='')
+    args = parser.parse_args(argv)
+    try:
+        results = upload_directory(args.dir, args.prefix)
+    except ConfigError as e:
+        logging.error(f"Error: {e}")
+        exit(1)
+    if not all(results.values()):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+# only one process refreshes the token, the others wait for it and read the cache
+from file_lock import locked
+
+TOKEN_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "zoom-to-youtube")
+# refresh a cached token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = 300
+
+
+def cache_path(cache_key):
+    digest = hashlib.sha256(cache_key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(TOKEN_CACHE_DIR, f"token-{digest}.json")
+
+
+def read_cached_token(path):
+    try:
+        with open(path, encoding="utf-8") as token_file:
+            return json.load(token_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_cached_token(path, cached):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as token_file:
+        json.dump(cached, token_file)
+    os.replace(tmp_path, path)
+
+
+def get_access_token(cache_key, fetch_token, stale_token=None):
+    """ Get an access token from the on-disk cache, fetching a new one when needed
+    :param cache_key: identifies the credentials the token belongs to, e.g. the account id
+    :param fetch_token: a callable returning the token endpoint json, or None on failure
+    :param stale_token: a token the API rejected, it is never returned from the cache
+    :return: the access token, or None if a new one couldn't be fetched
+    """
+    path = cache_path(cache_key)
+    with locked(path):
+        cached = read_cached_token(path)
+        if (
+            cached is not None
+            and cached.get("access_token") != stale_token
+            and cached.get("expires_at", 0) - TOKEN_EXPIRY_MARGIN > time.time()
+        ):
+            return cached["access_token"]
+        response_json = fetch_token()
+        if response_json is None:
+            return None
+        try:
+            access_token = response_json["access_token"]
+        except KeyError:
+            logging.error("### The key 'access_token' wasn't found.")
+            return None
+        expires_in = int(response_json.get("expires_in", 0))
+        try:
+            write_cached_token(path, {"access_token": access_token, "expires_at": time.time() + expires_in})
+        except OSError as e:
+            logging.warning(f"Unable to cache the access token in {path}: {e}")
+        return access_token
@@ -1,21 +1,52 @@
+import argparse
 import json
 import os
 import pprint
+import time
+
+import requests
 import vimeo
 
+import metrics
+from config import ConfigError, config_path, load_config
+from resumable_upload import EXPIRED_STATUS_CODES, ResumableUploader, UploadSessionExpired
+from token_cache import TOKEN_CACHE_DIR
+
+VIMEO_UPLOAD_ENDPOINT = '/me/videos'
+TUS_VERSION = '1.0.0'
+TUS_TIMEOUT = (10, 300)
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_UPLOAD_JOBS = 3
+MAX_CHUNK_ATTEMPTS = 5
+# the transcode status of up to this many videos is read with one call
+TRANSCODE_BATCH_SIZE = 100
+TRANSCODE_MIN_DELAY = 10
+TRANSCODE_MAX_DELAY = 300
+TRANSCODE_TIMEOUT = 4 * 60 * 60
+TRANSCODE_FINAL_STATUSES = ('complete', 'error')
+# the tus upload link and offset of a file are kept next to it until the upload is complete
+UPLOAD_STATE_SUFFIX = '.vimeo-upload.json'
+# the largest page the API returns
+LIST_PAGE_SIZE = 100
+# folder name -> uri lookups are answered from this file while they are younger than FOLDER_CACHE_TTL
+FOLDER_CACHE_FILE = os.path.join(TOKEN_CACHE_DIR, 'vimeo-folders.json')
+FOLDER_CACHE_TTL = 24 * 60 * 60
+
 
-class vimeouploader:
+class vimeouploader(ResumableUploader):
 
-    def __init__(self):
+    state_suffix = UPLOAD_STATE_SUFFIX
+    default_jobs = DEFAULT_UPLOAD_JOBS
 
-        config_file = os.path.dirname(os.path.realpath(__file__)) + '/downloader.conf'
-        config = json.load(open(config_file))
+    def __init__(self, chunk_size=None, config_file=None):
+
+        config = load_config(config_file)
 
         # Check for a config file
-        if 'client_id' not in config['vimeo'] or 'client_secret' not in config['vimeo']:
-            raise Exception('We could not locate your client id or client secret ' +
-                            'in `' + config_file + '`. Please create one, and ' +
-                            'reference `config.json.example`.')
+        if 'client_id' not in config.get('vimeo', {}) or 'client_secret' not in config['vimeo']:
+            raise ConfigError('We could not locate your client id or client secret ' +
+                              'in `' + (config_file or config_path()) + '`. Please create one, and ' +
+                              'reference `config.json.example`.')
 
         # Instantiate the library with your client id, secret and access token
         # (pulled from dev site)
@@ -24,51 +55,253 @@ class vimeouploader:
             key=config['vimeo']['client_id'],
             secret=config['vimeo']['client_secret']
         )
+        if 'api_root' in config['vimeo']:
+            # a local stand-in for testing
+            self.client.API_ROOT = config['vimeo']['api_root']
+        self.chunk_size = chunk_size or config['vimeo'].get('chunk_size', DEFAULT_CHUNK_SIZE)
+        self.session = requests.Session()
 
 
 
-    def upload(self, file_name):
+    def create_upload(self, file_name, name, description):
+        """ Create the video on Vimeo and get its tus upload link """
+        stat = os.stat(file_name)
+        data = {
+            'upload': {'approach': 'tus', 'size': stat.st_size},
+            'name': name or os.path.basename(file_name),
+            'description': description or '',
+        }
+        attempt = self.client.post(VIMEO_UPLOAD_ENDPOINT, data=data, params={'fields': 'uri,upload'})
+        if attempt.status_code not in (200, 201):
+            raise vimeo.exceptions.UploadAttemptCreationFailure(attempt, 'Unable to initiate an upload attempt.')
+        attempt = attempt.json()
+        state = {
+            'uri': attempt['uri'],
+            'upload_link': attempt['upload']['upload_link'],
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'offset': 0,
+        }
+        self.save_state(file_name, state)
+        return state
 
-        try:
-            # Upload the file and include the video title and description.
-            uri = self.client.upload(file_name, data={
-                'name': 'Vimeo API SDK test upload',
-                'description': "This video was uploaded through the Vimeo API's " +
-                            "Python SDK."
-            })
+    def get_offset(self, upload_link):
+        """ Ask the tus server how many bytes of an upload it already has
+        :raise UploadSessionExpired: if the upload link is gone
+        """
+        response = self.session.head(upload_link, headers={'Tus-Resumable': TUS_VERSION}, timeout=TUS_TIMEOUT)
+        if response.status_code in EXPIRED_STATUS_CODES:
+            raise UploadSessionExpired(upload_link)
+        response.raise_for_status()
+        return int(response.headers['Upload-Offset'])
 
-            # Get the metadata response from the upload and log out the Vimeo.com url
-            video_data = self.client.get(uri + '?fields=link').json()
-            print('"{}" has been uploaded to {}'.format(file_name, video_data['link']))
+    def send_chunks(self, file_name, state, span):
+        """ Send the rest of a file in tus chunks
+        :param span: the metrics span the sent bytes are added to
+        """
+        attempts = 0
+        with open(file_name, 'rb') as video_file:
+            while state['offset'] < state['size']:
+                video_file.seek(state['offset'])
+                chunk = video_file.read(self.chunk_size)
+                try:
+                    response = self.session.patch(state['upload_link'], data=chunk, timeout=TUS_TIMEOUT, headers={
+                        'Tus-Resumable': TUS_VERSION,
+                        'Upload-Offset': str(state['offset']),
+                        'Content-Type': 'application/offset+octet-stream',
+                    })
+                    if response.status_code in EXPIRED_STATUS_CODES:
+                        raise UploadSessionExpired(state['upload_link'])
+                    response.raise_for_status()
+                    span.add_bytes(int(response.headers['Upload-Offset']) - state['offset'])
+                    state['offset'] = int(response.headers['Upload-Offset'])
+                    attempts = 0
+                except requests.RequestException as e:
+                    metrics.count('upload_retries', stage='upload_vimeo')
+                    attempts += 1
+                    if attempts >= MAX_CHUNK_ATTEMPTS:
+                        raise requests.RequestException('Uploading a chunk failed too many times: {}'.format(e))
+                    time.sleep(2 ** attempts)
+                    state['offset'] = self.get_offset(state['upload_link'])
+                self.save_state(file_name, state)
 
-            # Make an API call to edit the title and description of the video.
-            self.client.patch(uri, data={
-                'name': 'Vimeo API SDK test edit',
-                'description': "This video was edited through the Vimeo API's " +
-                            "Python SDK."
+    def upload(self, file_name, name=None, description=None):
+        """ Upload a file in tus chunks, resuming an upload that was interrupted before
+        :param file_name: the video file
+        :param name: the video title, the file name if not given
+        :param description: the video description
+        :return: the uri of the video, or None if the upload failed
+        """
+        uri = self.uploaded(file_name)
+        if uri is not None:
+            print('"{}" is already uploaded to {}'.format(file_name, uri))
+            return uri
+        with metrics.span('upload_vimeo', file=file_name) as span:
+            try:
+                state = self.load_state(file_name)
+                try:
+                    if state is not None:
+                        state['offset'] = self.get_offset(state['upload_link'])
+                        print('Resuming upload of {} at byte {}'.format(file_name, state['offset']))
+                    else:
+                        state = self.create_upload(file_name, name, description)
+                    self.send_chunks(file_name, state, span)
+                except UploadSessionExpired:
+                    print('The upload link of {} expired, starting over'.format(file_name))
+                    self.remove_state(file_name)
+                    state = self.create_upload(file_name, name, description)
+                    self.send_chunks(file_name, state, span)
+
+                self.mark_uploaded(file_name, state, state['uri'])
+                print('"{}" has been uploaded to {}'.format(file_name, state['uri']))
+                return state['uri']
+            except (UploadSessionExpired, vimeo.exceptions.BaseVimeoException, requests.RequestException) as e:
+                # We may have had an error. We can't resolve it here necessarily, so
+                # report it to the user, the saved state lets the next run resume it.
+                print('Error uploading %s' % file_name)
+                print('Server reported: %s' % getattr(e, 'message', e))
+                span.fail()
+                return None
+
+    def upload_meeting(self, outputs, title, description='', jobs=DEFAULT_UPLOAD_JOBS):
+        """ Upload the per-language videos of a meeting
+        :param outputs: a dict of language -> video file
+        :param title: the meeting title, the language is appended to it
+        :return: a dict of language -> uri, or None if the upload failed
+        """
+        uploads = [(file_name, '{} ({})'.format(title, language), description) for language, file_name in outputs.items()]
+        uris = self.upload_all(uploads, jobs)
+        return {language: uris[file_name] for language, file_name in outputs.items()}
+
+    def get_transcode_statuses(self, uris):
+        """ Get the transcode status of many videos with as few calls as possible
+        :param uris: a list of video uris
+        :return: a dict of uri -> transcode status
+        """
+        statuses = {}
+        for start in range(0, len(uris), TRANSCODE_BATCH_SIZE):
+            batch = uris[start:start + TRANSCODE_BATCH_SIZE]
+            response = self.client.get('/videos', params={
+                'uris': ','.join(batch),
+                'fields': 'uri,transcode.status',
+                'per_page': len(batch),
             })
+            response.raise_for_status()
+            for video in response.json()['data']:
+                statuses[video['uri']] = video['transcode']['status']
+        return statuses
 
-            print('The title and description for %s has been edited.' % uri)
+    def watch_transcodes(self, uris, timeout=TRANSCODE_TIMEOUT):
+        """ Wait until every uploaded video finished transcoding
+        The polling interval grows while nothing changes and is reset when a status changes.
+        :param uris: a list of video uris
+        :param timeout: seconds to wait before giving up on the videos still in progress
+        :return: a dict of uri -> last known transcode status
+        """
+        statuses = {uri: 'in_progress' for uri in uris}
+        pending = list(uris)
+        delay = TRANSCODE_MIN_DELAY
+        deadline = time.monotonic() + timeout
+        while pending:
+            try:
+                updated = self.get_transcode_statuses(pending)
+            except (vimeo.exceptions.BaseVimeoException, requests.RequestException) as e:
+                print('Checking the transcode status failed: %s' % getattr(e, 'message', e))
+                updated = {}
+            changed = False
+            for uri, status in updated.items():
+                if status != statuses.get(uri):
+                    changed = True
+                    print('The transcode status for {} is: {}'.format(uri, status))
+                statuses[uri] = status
+            pending = [uri for uri in pending if statuses[uri] not in TRANSCODE_FINAL_STATUSES]
+            if not pending or time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+            delay = TRANSCODE_MIN_DELAY if changed else min(delay * 2, TRANSCODE_MAX_DELAY)
 
-            # Make an API call to see if the video is finished transcoding.
-            video_data = self.client.get(uri + '?fields=transcode.status').json()
-            print('The transcode status for {} is: {}'.format(
-                uri,
-                video_data['transcode']['status']
-            ))
-        except vimeo.exceptions.VideoUploadFailure as e:
-            # We may have had an error. We can't resolve it here necessarily, so
-            # report it to the user.
-            print('Error uploading %s' % file_name)
-            print('Server reported: %s' % e.message)
+        complete = [uri for uri, status in statuses.items() if status == 'complete']
+        print('{} of {} videos finished transcoding'.format(len(complete), len(statuses)))
+        for uri, status in statuses.items():
+            if status != 'complete':
+                print('{} - {}'.format(uri, status))
+        return statuses
+
+    def iter_pages(self, uri, params=None, response=None):
+        """ Iterate lazily over the items of a paginated listing, a page is only fetched when it is reached
+        :param uri: the listing endpoint
+        :param params: the query parameters of the first page, the next pages carry them in their link
+        :param response: the already fetched first page, if any
+        :return: a generator of items
+        """
+        params = dict(params or {})
+        params.setdefault('per_page', LIST_PAGE_SIZE)
+        if response is None:
+            response = self.client.get(uri, params=params)
+        while True:
+            response.raise_for_status()
+            page = response.json()
+            yield from page['data']
+            next_page = (page.get('paging') or {}).get('next')
+            if not next_page:
+                return
+            response = self.client.get(next_page)
 
+    def load_folder_cache(self):
+        try:
+            with open(FOLDER_CACHE_FILE) as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_folder_cache(self, cache):
+        os.makedirs(os.path.dirname(FOLDER_CACHE_FILE), exist_ok=True)
+        tmp_name = '{}.{}.tmp'.format(FOLDER_CACHE_FILE, os.getpid())
+        with open(tmp_name, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_name, FOLDER_CACHE_FILE)
+
+    def find_folder(self, folder_name, refresh=False):
+        """ Get the uri of a folder by its name
+        A cached uri younger than FOLDER_CACHE_TTL costs no request. Otherwise the folders are
+        searched by name, revalidating the cached answer with its ETag when there is one.
+        :param folder_name: the exact folder name
+        :param refresh: ignore the cached uri
+        :return: the folder uri, or None if there is no such folder
+        """
+        cache = self.load_folder_cache()
+        entry = cache.get(folder_name)
+        if entry and not refresh and time.time() - entry['cached_at'] < FOLDER_CACHE_TTL:
+            return entry['uri']
+
+        params = {'query': folder_name, 'fields': 'uri,name', 'per_page': LIST_PAGE_SIZE}
+        headers = {'If-None-Match': entry['etag']} if entry and entry.get('etag') and not refresh else {}
+        response = self.client.get('/me/folders', params=params, headers=headers)
+        if response.status_code == 304:
+            entry['cached_at'] = time.time()
+            self.save_folder_cache(cache)
+            return entry['uri']
+
+        etag = response.headers.get('ETag')
+        now = time.time()
+        uri = None
+        for folder in self.iter_pages('/me/folders', params, response):
+            cache[folder['name']] = {'uri': folder['uri'], 'cached_at': now}
+            if folder['name'] == folder_name:
+                uri = folder['uri']
+        if uri is None:
+            cache.pop(folder_name, None)
+        elif etag:
+            cache[folder_name]['etag'] = etag
+        self.save_folder_cache(cache)
+        return uri
 
     def list(self):
         # Get the user's uploaded videos
-        videos = self.client.get('/me/videos')
+        videos = self.iter_pages('/me/videos', {'fields': 'name,link,privacy.view'})
 
         # Print out their names, the url to their page, and their privacy
-        for video in videos.json()['data']:
+        for video in videos:
             print('{} - {} - {}'.format(
                 video['name'],
                 video['link'],
@@ -76,26 +309,55 @@ class vimeouploader:
             ))
 
     def listFolder(self, folder_name):
-        # Get the user's uploaded videos
-        folders = self.client.get('/me/folders') # + folder + '/videos')
+        folder_uri = self.find_folder(folder_name)
+        if folder_uri is None:
+            print('There is no folder named {}'.format(folder_name))
+            return
 
-        # Print out their names, the url to their page, and their privacy
-        for folders in folders.json()['data']:
-            if folders['name'] == folder_name:
-                print('{} - {} '.format(
-                    folders['name'],
-                    folders['uri'],
-                ))
-                videos = self.client.get(folders['uri'] + '/videos?sort=alphabetical')
-                for video in videos.json()['data']:
-                    #pprint.pprint(video)
-                    print(f"{video['name'][:2]} - {video['link']}")
-
-def main():
-    print("Hello World")
-    uploader = vimeouploader()
-    #uploader.upload('test.mp4')
-    uploader.listFolder('gc-2023-12-20')
+        params = {'sort': 'alphabetical', 'fields': 'name,link'}
+        try:
+            videos = list(self.iter_pages(folder_uri + '/videos', params))
+        except requests.HTTPError as e:
+            if e.response.status_code != 404:
+                raise
+            # the folder was deleted or recreated since its uri was cached
+            folder_uri = self.find_folder(folder_name, refresh=True)
+            if folder_uri is None:
+                print('There is no folder named {}'.format(folder_name))
+                return
+            videos = list(self.iter_pages(folder_uri + '/videos', params))
+
+        print('{} - {} '.format(folder_name, folder_uri))
+        for video in videos:
+            #pprint.pprint(video)
+            print(f"{video['name'][:2]} - {video['link']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='upload videos to vimeo')
+    parser.add_argument('files', help='video files to upload', nargs='*')
+    parser.add_argument('--title', help='video title, the file name by default')
+    parser.add_argument('--description', help='video description', default='')
+    parser.add_argument('--jobs', help='number of files uploading at once', default=DEFAULT_UPLOAD_JOBS, type=int)
+    parser.add_argument('--chunk-size', help='upload chunk size in MB', default=None, type=int)
+    parser.add_argument('--watch', help='wait until the uploaded videos finished transcoding', action='store_true')
+    parser.add_argument('--list-folder', help='list the videos of a folder instead of uploading')
+    args = parser.parse_args(argv)
+
+    try:
+        uploader = vimeouploader(args.chunk_size * 1024 * 1024 if args.chunk_size else None)
+    except ConfigError as e:
+        print('Error: %s' % e)
+        exit(1)
+    if args.list_folder:
+        uploader.listFolder(args.list_folder)
+        return
+    if not args.files:
+        parser.error('no video files given')
+    uris = uploader.upload_all([(file_name, args.title, args.description) for file_name in args.files], args.jobs)
+    if args.watch:
+        uploader.watch_transcodes([uri for uri in uris.values() if uri is not None])
+    if None in uris.values():
+        exit(1)
 
 if __name__ == "__main__":
     main()
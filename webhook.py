@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import downloader
+from config import ConfigError, load_config
+from manifest import DownloadManifest
+
+EVENT_URL_VALIDATION = "endpoint.url_validation"
+EVENT_RECORDING_COMPLETED = "recording.completed"
+
+# reject events whose timestamp is further than this from now, in seconds
+WEBHOOK_TIMESTAMP_TOLERANCE = 300
+MAX_CONCURRENT_MEETINGS = 2
+DEFAULT_PORT = 8080
+
+
+def sign(secret_token, message):
+    return hmac.new(secret_token.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def signature(secret_token, timestamp, body):
+    """ The x-zm-signature Zoom sends with every event """
+    return "v0=" + sign(secret_token, f"v0:{timestamp}:".encode("utf-8") + body)
+
+
+def verify_signature(secret_token, headers, body):
+    """ Check the x-zm-signature and x-zm-request-timestamp headers of an event
+    :return: True if the event was signed with our secret token and is recent
+    """
+    timestamp = headers.get("x-zm-request-timestamp", "")
+    received = headers.get("x-zm-signature", "")
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > WEBHOOK_TIMESTAMP_TOLERANCE:
+        return False
+    return hmac.compare_digest(received, signature(secret_token, timestamp, body))
+
+
+def recording_error(recording):
+    """ Check the payload object of a recording.completed event before its download is queued
+    :return: what is wrong with it, None if it can be downloaded
+    """
+    if not isinstance(recording, dict):
+        return "no recording object"
+    if not isinstance(recording.get("uuid"), str) or not recording["uuid"]:
+        return "no meeting uuid"
+    if not isinstance(recording.get("start_time"), str) or not re.match(downloader.RECORDING_TIME_FORMAT, recording["start_time"]):
+        return "no valid start_time"
+    recording_files = recording.get("recording_files", [])
+    if not isinstance(recording_files, list):
+        return "no recording_files list"
+    for recording_file in recording_files:
+        if not isinstance(recording_file, dict):
+            return "a recording file that isn't an object"
+        for key in ("recording_type", "download_url", "file_extension"):
+            if not isinstance(recording_file.get(key), str) or not recording_file[key]:
+                return f"a recording file without {key}"
+    return None
+
+
+def download_meeting(recording, output_dir, jobs=downloader.DEFAULT_DOWNLOAD_JOBS, segments=1):
+    """ Download the recording_files of a recording.completed event
+    :param recording: the payload object of the event
+    :param output_dir: the base directory, the meeting gets its own directory in it
+    :return: a list of the files that failed
+    """
+    # a cached token is reused, so this only hits the token endpoint once an hour
+    with downloader.ZOOM_ACCESS_TOKEN_LOCK:
+        downloader.ZOOM_ACCESS_TOKEN = downloader.load_zoom_access_token()
+    meeting_dir = downloader.meeting_output_dir(output_dir, recording)
+    os.makedirs(meeting_dir, exist_ok=True)
+    manifest = DownloadManifest(meeting_dir)
+    downloads = downloader.prepare_downloads(recording, manifest)
+    results = downloader.download_all(downloads, meeting_dir, jobs, segments)
+    for output_file_name, content_hash in results.items():
+        if content_hash:
+            manifest.mark_done(output_file_name, content_hash)
+    manifest.save()
+    failed = [output_file_name for output_file_name, content_hash in results.items() if not content_hash]
+    if failed:
+        logging.error(f"{downloader.Color.RED}### {len(failed)} downloads failed for {meeting_dir}: {', '.join(sorted(failed))}{downloader.Color.END}")
+    else:
+        logging.info(f"==> Recordings of {recording.get('topic', recording.get('uuid'))} saved to {meeting_dir}")
+    return failed
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, data=None):
+        body = json.dumps(data or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not verify_signature(self.server.secret_token, self.headers, body):
+            logging.warning(f"Rejected webhook event with an invalid signature from {self.client_address[0]}")
+            self.send_json(401)
+            return
+        try:
+            event = json.loads(body)
+        except json.JSONDecodeError:
+            self.send_json(400)
+            return
+        payload = event.get("payload") if isinstance(event, dict) else None
+        if not isinstance(payload, dict):
+            logging.warning(f"Rejected webhook event without a payload from {self.client_address[0]}")
+            self.send_json(400)
+            return
+
+        if event.get("event") == EVENT_URL_VALIDATION:
+            plain_token = payload.get("plainToken")
+            if not isinstance(plain_token, str) or not plain_token:
+                logging.warning(f"Rejected url validation without a plainToken from {self.client_address[0]}")
+                self.send_json(400)
+                return
+            self.send_json(200, {
+                "plainToken": plain_token,
+                "encryptedToken": sign(self.server.secret_token, plain_token.encode("utf-8"))
+            })
+        elif event.get("event") == EVENT_RECORDING_COMPLETED:
+            recording = payload.get("object")
+            error = recording_error(recording)
+            if error is not None:
+                logging.warning(f"Rejected recording.completed with {error} from {self.client_address[0]}")
+                self.send_json(400)
+                return
+            logging.info(f"==> Recording completed: {recording.get('topic')} {recording.get('start_time')}")
+            # answer right away, Zoom retries events that take more than a few seconds
+            self.server.submit(recording)
+            self.send_json(200)
+        else:
+            self.send_json(200)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """ Listens for Zoom webhook events and downloads every completed recording """
+
+    def __init__(self, address, secret_token, output_dir, jobs=downloader.DEFAULT_DOWNLOAD_JOBS, segments=1):
+        super().__init__(address, WebhookHandler)
+        self.secret_token = secret_token
+        self.output_dir = output_dir
+        self.jobs = jobs
+        self.segments = segments
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_MEETINGS)
+        # the uuids of the meetings queued or downloading, Zoom may send an event more than once
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+
+    def submit(self, recording):
+        """ Queue the download of a recording, unless the same meeting is already queued or downloading
+        :return: the future of the download, None for a duplicate event
+        """
+        meeting_uuid = recording["uuid"]
+        with self.in_flight_lock:
+            if meeting_uuid in self.in_flight:
+                logging.info(f"==> Recording {meeting_uuid} is already being downloaded, skipping the repeated event")
+                return None
+            self.in_flight.add(meeting_uuid)
+        future = self.executor.submit(download_meeting, recording, self.output_dir, self.jobs, self.segments)
+        future.add_done_callback(lambda done: self.finish(recording, done))
+        return future
+
+    def finish(self, recording, future):
+        with self.in_flight_lock:
+            self.in_flight.discard(recording["uuid"])
+        self.log_failure(recording, future)
+
+    @staticmethod
+    def log_failure(recording, future):
+        """ Nobody waits for a download, so an exception would otherwise go unnoticed """
+        if future.cancelled():
+            logging.warning(f"Download of {recording.get('uuid')} was cancelled")
+            return
+        error = future.exception()
+        if error is not None:
+            logging.error(
+                f"{downloader.Color.RED}### Download of {recording.get('topic', recording.get('uuid'))} failed: {error}{downloader.Color.END}",
+                exc_info=error
+            )
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def send_event(url, secret_token, event):
+    """ A fake Zoom sender, signs an event the way Zoom does and posts it to a listener
+    :return: the listener's response
+    """
+    body = json.dumps(event).encode("utf-8")
+    timestamp = str(int(time.time()))
+    return requests.post(url, data=body, timeout=30, headers={
+        "Content-Type": "application/json",
+        "x-zm-request-timestamp": timestamp,
+        "x-zm-signature": signature(secret_token, timestamp, body)
+    })
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='zoom recording.completed webhook listener')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    listen_parser = subparsers.add_parser('listen', help='listen for webhook events and download the recordings')
+    listen_parser.add_argument('--host', default='0.0.0.0')
+    listen_parser.add_argument('--port', default=DEFAULT_PORT, type=int)
+    listen_parser.add_argument('--dir', help='Output file path', required=True)
+    listen_parser.add_argument('--jobs', help='number of concurrent downloads', default=downloader.DEFAULT_DOWNLOAD_JOBS, type=int)
+    listen_parser.add_argument('--segments', help='number of parallel byte ranges per file', default=1, type=int)
+    send_parser = subparsers.add_parser('send', help='send a signed test event to a listener')
+    send_parser.add_argument('--url', default=f'http://127.0.0.1:{DEFAULT_PORT}/')
+    send_parser.add_argument('--event', help='json file with the event to send', required=True)
+    args = parser.parse_args(argv)
+
+    try:
+        secret_token = load_config()["zoom_webhook"]["secret_token"]
+    except ConfigError as e:
+        logging.error(f"Error: {e}")
+        sys.exit(1)
+    if args.command == 'send':
+        with open(args.event, encoding="utf-8") as event_file:
+            response = send_event(args.url, secret_token, json.load(event_file))
+        logging.info(f"Listener answered {response.status_code} {response.text}")
+        return
+
+    server = WebhookServer((args.host, args.port), secret_token, args.dir, args.jobs, args.segments)
+    logging.info(f"==> Listening for zoom webhook events on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
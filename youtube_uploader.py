@@ -0,0 +1,243 @@
+import argparse
+import os
+import time
+
+import requests
+
+import metrics
+from config import ConfigError, config_path, load_config
+from resumable_upload import EXPIRED_STATUS_CODES, ResumableUploader, UploadSessionExpired
+from token_cache import get_access_token
+
+YOUTUBE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+YOUTUBE_UPLOAD_URL = 'https://www.googleapis.com/upload/youtube/v3/videos'
+YOUTUBE_CATEGORY = '27'
+YOUTUBE_TIMEOUT = (10, 300)
+# chunks must be a multiple of 256 KiB, except for the last one
+CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_UPLOAD_JOBS = 2
+MAX_CHUNK_ATTEMPTS = 5
+# youtube rejects longer titles and angle brackets in them
+MAX_TITLE_LENGTH = 100
+# the resumable session uri and offset of a file are kept next to it until the upload is complete
+UPLOAD_STATE_SUFFIX = '.youtube-upload.json'
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class youtubeuploader(ResumableUploader):
+
+    state_suffix = UPLOAD_STATE_SUFFIX
+    default_jobs = DEFAULT_UPLOAD_JOBS
+
+    def __init__(self, chunk_size=None, upload_url=None, token_url=None, config_file=None):
+
+        config = load_config(config_file)
+
+        # Check for a config file
+        if 'youtube_oauth' not in config or 'refresh_token' not in config['youtube_oauth']:
+            raise ConfigError('We could not locate your youtube refresh token ' +
+                              'in `' + (config_file or config_path()) + '`.')
+
+        self.config = config['youtube_oauth']
+        chunk_size = chunk_size or self.config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        self.chunk_size = max(1, chunk_size // CHUNK_GRANULARITY) * CHUNK_GRANULARITY
+        # the endpoints can point at a local stand-in for testing
+        self.upload_url = upload_url or self.config.get('upload_url', YOUTUBE_UPLOAD_URL)
+        self.token_url = token_url or self.config.get('token_url', YOUTUBE_TOKEN_URL)
+        self.session = requests.Session()
+        self.access_token = self.config.get('access_token')
+
+    def request_access_token(self):
+        """ Trade the refresh token for a new access token """
+        response = self.session.post(self.token_url, timeout=YOUTUBE_TIMEOUT, data={
+            'client_id': self.config['client_id'],
+            'client_secret': self.config['client_secret'],
+            'refresh_token': self.config['refresh_token'],
+            'grant_type': 'refresh_token',
+        })
+        if response.status_code != 200:
+            print('Refreshing the youtube access token failed: %s' % response.text)
+            return None
+        return response.json()
+
+    def load_access_token(self, stale_token=None):
+        self.access_token = get_access_token(
+            'youtube:' + self.config['client_id'], self.request_access_token, stale_token
+        )
+        if self.access_token is None:
+            raise requests.RequestException('No youtube access token')
+
+    def request(self, method, url, **kwargs):
+        """ Send an authorized request, refreshing the access token once if it is rejected """
+        if self.access_token is None:
+            self.load_access_token()
+        for attempt in range(2):
+            headers = dict(kwargs.pop('headers', {}))
+            headers['Authorization'] = 'Bearer ' + self.access_token
+            response = self.session.request(method, url, headers=headers, timeout=YOUTUBE_TIMEOUT, **kwargs)
+            if response.status_code != 401 or attempt:
+                return response
+            self.load_access_token(self.access_token)
+            kwargs['headers'] = headers
+
+    def video_resource(self, name, description, tags=None):
+        title = (name or '').replace('<', '').replace('>', '')[:MAX_TITLE_LENGTH]
+        return {
+            'snippet': {
+                'title': title,
+                'description': description or '',
+                'tags': tags or [],
+                'categoryId': self.config.get('category_id', YOUTUBE_CATEGORY),
+            },
+            'status': {
+                # Video privacy. Can either be "public", "private", or "unlisted"
+                'privacyStatus': self.config.get('privacy_status', 'public'),
+            },
+        }
+
+    def create_upload(self, file_name, name, description, tags=None):
+        """ Start a resumable upload session for a file """
+        stat = os.stat(file_name)
+        response = self.request(
+            'POST', self.upload_url,
+            params={'uploadType': 'resumable', 'part': 'snippet,status'},
+            json=self.video_resource(name or os.path.basename(file_name), description, tags),
+            headers={'X-Upload-Content-Length': str(stat.st_size), 'X-Upload-Content-Type': 'video/*'},
+        )
+        response.raise_for_status()
+        state = {
+            'session_uri': response.headers['Location'],
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'offset': 0,
+        }
+        self.save_state(file_name, state)
+        return state
+
+    def parse_offset(self, response):
+        """ The next byte to send according to the Range header of a 308 response """
+        received = response.headers.get('Range')
+        return int(received.rsplit('-', 1)[1]) + 1 if received else 0
+
+    def get_offset(self, state):
+        """ Ask the upload session how many bytes it already has
+        :return: a tuple (offset, video id if the upload is already complete)
+        """
+        response = self.request('PUT', state['session_uri'], headers={
+            'Content-Range': 'bytes */{}'.format(state['size']),
+        })
+        if response.status_code in EXPIRED_STATUS_CODES:
+            raise UploadSessionExpired(state['session_uri'])
+        if response.status_code in (200, 201):
+            return state['size'], response.json()['id']
+        if response.status_code != 308:
+            response.raise_for_status()
+            raise requests.RequestException('Unexpected status {}'.format(response.status_code))
+        return self.parse_offset(response), None
+
+    def send_chunks(self, file_name, state, span):
+        """ Send the rest of a file in chunks
+        :param span: the metrics span the sent bytes are added to
+        :return: the id of the uploaded video
+        """
+        attempts = 0
+        video_id = None
+        with open(file_name, 'rb') as video_file:
+            while video_id is None:
+                video_file.seek(state['offset'])
+                chunk = video_file.read(self.chunk_size)
+                end = state['offset'] + len(chunk) - 1
+                try:
+                    response = self.request('PUT', state['session_uri'], data=chunk, headers={
+                        'Content-Range': 'bytes {}-{}/{}'.format(state['offset'], end, state['size']),
+                    })
+                    error = 'Server error {}'.format(response.status_code)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response = None
+                    error = e
+                if response is not None and response.status_code in EXPIRED_STATUS_CODES:
+                    raise UploadSessionExpired(state['session_uri'])
+                if response is not None and response.status_code in (200, 201):
+                    video_id = response.json()['id']
+                    span.add_bytes(state['size'] - state['offset'])
+                    state['offset'] = state['size']
+                elif response is not None and response.status_code == 308:
+                    offset = self.parse_offset(response)
+                    span.add_bytes(offset - state['offset'])
+                    state['offset'] = offset
+                    attempts = 0
+                elif response is None or response.status_code in RETRY_STATUS_CODES:
+                    metrics.count('upload_retries', stage='upload_youtube')
+                    attempts += 1
+                    if attempts >= MAX_CHUNK_ATTEMPTS:
+                        raise requests.RequestException('Uploading a chunk failed too many times: {}'.format(error))
+                    time.sleep(2 ** attempts)
+                    state['offset'], video_id = self.get_offset(state)
+                else:
+                    response.raise_for_status()
+                    raise requests.RequestException('Unexpected status {}'.format(response.status_code))
+                self.save_state(file_name, state)
+        return video_id
+
+    def upload(self, file_name, name=None, description=None, tags=None):
+        """ Upload a file with the resumable protocol, continuing an upload that was interrupted before
+        :param file_name: the video file
+        :param name: the video title, the file name if not given
+        :param description: the video description
+        :param tags: an optional list of tags
+        :return: the id of the video, or None if the upload failed
+        """
+        video_id = self.uploaded(file_name)
+        if video_id is not None:
+            print('"{}" is already uploaded to youtube as {}'.format(file_name, video_id))
+            return video_id
+        with metrics.span('upload_youtube', file=file_name) as span:
+            try:
+                state = self.load_state(file_name)
+                try:
+                    if state is not None:
+                        state['offset'], video_id = self.get_offset(state)
+                        print('Resuming upload of {} at byte {}'.format(file_name, state['offset']))
+                    else:
+                        state = self.create_upload(file_name, name, description, tags)
+                        video_id = None
+                    if video_id is None:
+                        video_id = self.send_chunks(file_name, state, span)
+                except UploadSessionExpired:
+                    print('The upload session of {} expired, starting over'.format(file_name))
+                    state = self.create_upload(file_name, name, description, tags)
+                    video_id = self.send_chunks(file_name, state, span)
+
+                self.mark_uploaded(file_name, state, video_id)
+                print('"{}" has been uploaded to youtube as {}'.format(file_name, video_id))
+                return video_id
+            except (UploadSessionExpired, requests.RequestException, KeyError, ValueError) as e:
+                # the saved state lets the next run resume the upload
+                print('Error uploading %s' % file_name)
+                print('Server reported: %s' % e)
+                span.fail()
+                return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='upload videos to youtube')
+    parser.add_argument('files', help='video files to upload', nargs='+')
+    parser.add_argument('--title', help='video title, the file name by default')
+    parser.add_argument('--description', help='video description', default='')
+    parser.add_argument('--jobs', help='number of files uploading at once', default=DEFAULT_UPLOAD_JOBS, type=int)
+    parser.add_argument('--chunk-size', help='upload chunk size in MB', default=None, type=int)
+    args = parser.parse_args(argv)
+
+    try:
+        uploader = youtubeuploader(args.chunk_size * 1024 * 1024 if args.chunk_size else None)
+    except ConfigError as e:
+        print('Error: %s' % e)
+        exit(1)
+    video_ids = uploader.upload_all([(file_name, args.title, args.description) for file_name in args.files], args.jobs)
+    if None in video_ids.values():
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()